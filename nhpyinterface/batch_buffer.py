@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:05:12 2026
+
+@author: dandrews
+
+Preallocated step results for a batch of environments.
+"""
+from collections import namedtuple
+import numpy as np
+
+Batch = namedtuple('batch', 's actions rewards s_ dones infos')
+
+
+class BatchBuffer():
+    """
+    Contiguous arrays that every environment of a batch writes its step
+    results into, one slot per environment. The arrays are rings of
+    `capacity` batches so the views handed out for a step stay valid for
+    the next capacity - 1 steps, long enough to copy into a replay memory.
+
+    Pass a multiprocessing.shared_memory.SharedMemory of at least
+    BatchBuffer.nbytes(...) to lay the arrays out in shared memory, worker
+    processes attach with the same arguments and the memory's buffer.
+    """
+    def __init__(self, num_envs, obs_shape=(84,84,3), obs_dtype=np.float32,
+                 info_size=2, capacity=2, with_states=True, buffer=None):
+        self.num_envs = num_envs
+        self.capacity = capacity
+        self.slot = 0
+        layout = self._layout(num_envs, obs_shape, obs_dtype, info_size,
+                              capacity, with_states)
+        offset = 0
+        for name, shape, dtype in layout:
+            if buffer is None:
+                array = np.zeros(shape, dtype=dtype)
+            else:
+                array = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            offset += self._aligned(array.nbytes)
+            setattr(self, name, array)
+        if not with_states:
+            self.s = None
+
+    @staticmethod
+    def _aligned(nbytes, alignment=64):
+        return -(-nbytes // alignment) * alignment
+
+    @staticmethod
+    def _layout(num_envs, obs_shape, obs_dtype, info_size, capacity, with_states):
+        ring = (capacity, num_envs)
+        layout = [('s_', ring + tuple(obs_shape), obs_dtype),
+                  ('actions', ring, np.int32),
+                  ('rewards', ring, np.float32),
+                  ('dones', ring, np.bool_),
+                  ('infos', ring + (info_size,), np.float32)]
+        if with_states:
+            layout.append(('s', ring + tuple(obs_shape), obs_dtype))
+        return layout
+
+    @classmethod
+    def nbytes(cls, num_envs, obs_shape=(84,84,3), obs_dtype=np.float32,
+               info_size=2, capacity=2, with_states=True):
+        """
+        Size of the memory needed to hold a buffer with these arguments.
+        """
+        layout = cls._layout(num_envs, obs_shape, obs_dtype, info_size,
+                             capacity, with_states)
+        return sum(cls._aligned(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+                   for _, shape, dtype in layout)
+
+    def advance(self):
+        """
+        Move on to the next slot of the ring, returns its index.
+        """
+        self.slot = (self.slot + 1) % self.capacity
+        return self.slot
+
+    def store(self, slot, index, s, action, r, s_, t, info):
+        """
+        Write one environment's step into its place in the batch. s and s_
+        may be None when they were already written in place.
+        """
+        if self.s is not None and s is not None:
+            self.s[slot, index] = s
+        self.actions[slot, index] = action
+        self.rewards[slot, index] = r
+        if s_ is not None:
+            self.s_[slot, index] = s_
+        self.dones[slot, index] = t
+        self.infos[slot, index] = info
+
+    def views(self, slot=None):
+        """
+        Views of the whole batch for one slot, nothing is copied.
+        """
+        if slot is None:
+            slot = self.slot
+        s = None if self.s is None else self.s[slot]
+        return Batch(s, self.actions[slot], self.rewards[slot], self.s_[slot],
+                     self.dones[slot], self.infos[slot])
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:04:51 2026
+
+@author: dandrews
+
+Repeatable benchmarks of each stage of the step pipeline, from parsing the
+telnet bytes to batch stepping many environments. Stages below NhEnv run
+offline on a recorded stream, a SessionRecorder file or by default frames
+generated by mock_server.MockSession. NhEnv.step and batch stepping run
+against a local MockServer. Results are saved as JSON so runs on
+different versions can be compared:
+    python benchmarks.py --out before.json
+    python benchmarks.py --out after.json --compare before.json
+"""
+from mock_server import MockServer, MockSession, MOVES
+from nh_environment import NhEnv
+from nh_interface import NhInterface
+from recorder import Record, SessionReader
+from replay import ReplayInterface
+import itertools
+import json
+import logging
+import numpy as np
+import platform
+import random
+import subprocess
+import time
+
+
+def mock_stream(username=b'bench', moves=500, seed=0):
+    """
+    Records of a login and `moves` random moves played on a MockSession.
+    """
+    rng = random.Random(seed)
+    session = MockSession()
+    keys = [b'l', username + b'\n', username + b'\n', b'p', b'\n']
+    keys += [rng.choice(list(MOVES)) for _ in range(moves)]
+    records = [Record(0.0, b'', session.greeting())]
+    for key in keys:
+        records.append(Record(0.0, key, b''.join(session.feed(key))))
+    return records
+
+
+def pyte_has_glyph_map():
+    try:
+        from pyte import Screen
+    except ImportError:
+        return False
+    return hasattr(Screen(1, 1), 'glyph_map')
+
+
+def time_calls(func, setup=None, repeat=1000, warmup=10):
+    """
+    Times func() repeat times, after setup() when given which is not timed.
+    Returns the summary in seconds per call.
+    """
+    times = np.empty(repeat)
+    for i in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times[i - warmup] = elapsed
+    return {'calls': repeat,
+            'min': float(times.min()),
+            'median': float(np.median(times)),
+            'mean': float(times.mean()),
+            'p90': float(np.percentile(times, 90))}
+
+
+class StepBenchmarks():
+    """
+    The benchmark suite. Each stage is timed cold, after a new frame, so
+    the per generation caches do not hide its cost:
+        feed             _feed of one frame, terminal parsing and the
+                         dirty row observation update
+        buffer_to_npdata the glyphs observation, kept current by feed
+        read_states      _read_states with nothing left to read
+        get_status       status line parse
+        buffer_to_rgb    rgb observation copy
+        resize_state     rgb resize to NhEnv.output_shape
+        score_move       exploration score of the last move
+        step             one NhEnv.step against the mock server
+        batch_step[n]    one MultiThreadEnvironments.step_environments
+    """
+    logger = logging.getLogger(__name__)
+    stages = ['feed', 'buffer_to_npdata', 'read_states', 'get_status',
+              'buffer_to_rgb', 'resize_state', 'score_move', 'step']
+
+    def __init__(self, records=None, repeat=1000, env_repeat=200,
+                 env_counts=(1, 4, 16), latency=0.0, jitter=0.0,
+                 observation_dtype=np.float64, native_terminal=None):
+        """
+        native_terminal None parses with pyte if it is the vt_tiledata fork
+        with glyph_map, NhTerminal otherwise.
+        """
+        self.records = mock_stream() if records is None else records
+        self.repeat = repeat
+        self.env_repeat = env_repeat
+        self.env_counts = env_counts
+        self.latency = latency
+        self.jitter = jitter
+        self.observation_dtype = observation_dtype
+        if native_terminal is None:
+            native_terminal = not pyte_has_glyph_map()
+        self.native_terminal = native_terminal
+        self.results = {}
+
+    def _replay(self):
+        """
+        A ReplayInterface moved on to the first game screen and the frames
+        that follow it to cycle through.
+        """
+        nhi = ReplayInterface(self.records, 'bench')
+        nhi.set_observation_dtype(self.observation_dtype)
+        while not nhi.is_game_screen:
+            if nhi.step() is None:
+                raise ValueError("The stream never reaches the game screen")
+        frames = [record.data for record in nhi.records if record.data]
+        if not frames:
+            raise ValueError("No frames after the game screen")
+        return nhi, itertools.cycle(frames)
+
+    def _stage_benchmarks(self, nhi, frames):
+        env = NhEnv.__new__(NhEnv)
+        env.nhi = nhi
+        env.observation_dtype = self.observation_dtype
+        env.last_status = nhi.get_status()
+        env.last_screen = nhi.buffer_to_rgb()
+
+        def new_frame():
+            nhi._feed(next(frames))
+            nhi.invalidate()
+
+        return {'feed': (lambda: nhi._feed(next(frames)), None),
+                'buffer_to_npdata': (nhi.buffer_to_npdata, new_frame),
+                'read_states': (nhi._read_states, new_frame),
+                'get_status': (nhi.get_status, new_frame),
+                'buffer_to_rgb': (nhi.buffer_to_rgb, new_frame),
+                'resize_state': (lambda: env.resize_state(nhi.rgb), new_frame),
+                'score_move': (env.score_move, new_frame)}
+
+    def _run(self, name, func, setup, repeat, **extra):
+        self.logger.info("running {}".format(name))
+        result = time_calls(func, setup, repeat)
+        result.update(extra)
+        self.results[name] = result
+        return result
+
+    def _matches(self, name, only):
+        return not only or any(o in name for o in only)
+
+    def run(self, only=()):
+        """
+        Run every benchmark whose name contains one of only, all by
+        default. Returns {name: result}.
+        """
+        ReplayInterface.NATIVE_TERMINAL = self.native_terminal
+        NhInterface.NATIVE_TERMINAL = self.native_terminal
+        nhi, frames = self._replay()
+        for name, (func, setup) in self._stage_benchmarks(nhi, frames).items():
+            if self._matches(name, only):
+                self._run(name, func, setup, self.repeat)
+
+        env_names = ['step'] + ['batch_step[{}]'.format(n) for n in self.env_counts]
+        if not any(self._matches(name, only) for name in env_names):
+            return self.results
+        server = MockServer(latency=self.latency, jitter=self.jitter, seed=0).start_in_thread()
+        address = NhInterface.game_address, NhInterface.game_port
+        NhInterface.game_address, NhInterface.game_port = server.host, server.port
+        try:
+            if self._matches('step', only):
+                self._bench_step()
+            for n in self.env_counts:
+                if self._matches('batch_step[{}]'.format(n), only):
+                    self._bench_batch(n)
+        finally:
+            NhInterface.game_address, NhInterface.game_port = address
+            server.stop_thread()
+        return self.results
+
+    def _bench_step(self):
+        rng = random.Random(0)
+        env = NhEnv('bench', self.observation_dtype)
+        env.reset()
+        def step():
+            env.step(rng.randint(1, 9))
+            if env.is_done:
+                env.reset()
+        result = self._run('step', step, None, self.env_repeat)
+        env.close()
+        return result
+
+    def _bench_batch(self, n):
+        from threaded_environments import MultiThreadEnvironments
+        rng = random.Random(0)
+        mte = MultiThreadEnvironments(lambda env: (rng.randint(1, 9), 0))
+        mte.obs_dtype = self.observation_dtype
+        mte.create_envs(n)
+        mte.reset_all_environments()
+        result = self._run('batch_step[{}]'.format(n), mte.step_environments,
+                           mte.reset_done_environments, self.env_repeat,
+                           environments=len(mte.envs))
+        result['steps_per_second'] = len(mte.envs) / result['median']
+        mte.close()
+        return result
+
+    def metadata(self):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                    capture_output=True, text=True).stdout.strip()
+        except OSError:
+            commit = ''
+        return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'commit': commit,
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'records': len(self.records),
+                'repeat': self.repeat,
+                'env_repeat': self.env_repeat,
+                'latency': self.latency,
+                'jitter': self.jitter,
+                'observation_dtype': np.dtype(self.observation_dtype).name,
+                'native_terminal': self.native_terminal}
+
+    def save(self, file_name):
+        with open(file_name, 'w') as out:
+            json.dump({'metadata': self.metadata(), 'results': self.results}, out, indent=2)
+
+
+def load_results(file_name):
+    with open(file_name) as results_file:
+        return json.load(results_file)
+
+
+def compare_results(results, baseline, threshold=1.1):
+    """
+    Lines comparing the median of each benchmark in both {name: result}
+    dictionaries, flagging those slower than baseline by threshold.
+    """
+    lines = ["{:20s} {:>12s} {:>12s} {:>7s}".format('benchmark', 'median', 'baseline', 'ratio')]
+    for name, result in results.items():
+        if name not in baseline:
+            lines.append("{:20s} {:>12.3e} {:>12s}".format(name, result['median'], '-'))
+            continue
+        ratio = result['median'] / baseline[name]['median']
+        flag = ' slower' if ratio > threshold else ''
+        lines.append("{:20s} {:>12.3e} {:>12.3e} {:>7.2f}{}".format(
+                name, result['median'], baseline[name]['median'], ratio, flag))
+    return lines
+
+
+def format_results(results):
+    lines = ["{:20s} {:>12s} {:>12s} {:>12s}".format('benchmark', 'min', 'median', 'p90')]
+    for name, result in results.items():
+        lines.append("{:20s} {:>12.3e} {:>12.3e} {:>12.3e}".format(
+                name, result['min'], result['median'], result['p90']))
+    return lines
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the step pipeline stages.")
+    parser.add_argument('--out', help="save the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results to compare against")
+    parser.add_argument('--recording', help="replay this .nhrec recording instead of mock frames")
+    parser.add_argument('--only', nargs='*', default=(), help="benchmarks whose names contain any of these")
+    parser.add_argument('--repeat', type=int, default=1000, help="calls per stage benchmark")
+    parser.add_argument('--env-repeat', type=int, default=200, help="calls per step and batch benchmark")
+    parser.add_argument('--envs', type=int, nargs='*', default=[1, 4, 16], help="batch sizes")
+    parser.add_argument('--latency', type=float, default=0.0, help="mock server latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="mock server latency jitter in seconds")
+    parser.add_argument('--dtype', default='float64', help="observation dtype")
+    parser.add_argument('--terminal', choices=['auto', 'native', 'pyte'], default='auto',
+                        help="parse with NhTerminal or pyte, auto uses pyte if it has glyph_map")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    records = list(SessionReader(args.recording)) if args.recording else None
+    suite = StepBenchmarks(records, args.repeat, args.env_repeat, args.envs,
+                           args.latency, args.jitter, np.dtype(args.dtype),
+                           {'auto': None, 'native': True, 'pyte': False}[args.terminal])
+    suite.run(args.only)
+    print("\n".join(format_results(suite.results)))
+    if args.compare:
+        print()
+        print("\n".join(compare_results(suite.results, load_results(args.compare)['results'])))
+    if args.out:
+        suite.save(args.out)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:41:05 2026
+
+@author: dandrews
+
+Bounded per interface history of what was sent and received.
+"""
+from collections import deque
+from nh_terminal import NhTerminal
+import copy
+import time
+
+
+class History():
+    """
+    Ring buffer of the last `capacity` (timestamp, command, data) chunks
+    fed to an interface. Only raw bytes are kept, screens are rebuilt on
+    demand by replaying the data onto a terminal that holds the state
+    from before the oldest entry, so memory stays flat however long the
+    run. Evicted entries are written to `spill`, a recorder.SessionRecorder,
+    if one is given.
+    """
+    def __init__(self, capacity=1000, columns=80, lines=24, spill=None):
+        self.capacity = capacity
+        self.spill = spill
+        self.timestamps = deque(maxlen=capacity)
+        self.commands = deque(maxlen=capacity)
+        self.data = deque(maxlen=capacity)
+        self._base = NhTerminal(columns, lines)
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, command, data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        if len(self.data) == self.capacity:
+            old_timestamp = self.timestamps[0]
+            old_command = self.commands[0]
+            old_data = self.data[0]
+            self._base.feed(old_data)
+            if self.spill is not None:
+                self.spill.write(old_command, old_data, old_timestamp)
+        self.timestamps.append(timestamp)
+        self.commands.append(command)
+        self.data.append(data)
+
+    def clear(self):
+        """
+        Forget every entry, screens are rebuilt from the current one on.
+        """
+        for timestamp, command, data in zip(self.timestamps, self.commands, self.data):
+            self._base.feed(data)
+            if self.spill is not None:
+                self.spill.write(command, data, timestamp)
+        self.timestamps.clear()
+        self.commands.clear()
+        self.data.clear()
+
+    def close(self):
+        """
+        Spill whatever is still in the history and close the spill file.
+        """
+        if self.spill is None:
+            return
+        for timestamp, command, data in zip(self.timestamps, self.commands, self.data):
+            self.spill.write(command, data, timestamp)
+        self.spill.close()
+        self.spill = None
+
+    def screens(self):
+        """
+        Yields the display after each entry, oldest first.
+        """
+        terminal = copy.deepcopy(self._base)
+        for data in self.data:
+            terminal.feed(data)
+            yield list(terminal.display)
+
+    def screen(self, index):
+        """
+        The display after entry index, negative indices count from the end.
+        """
+        if index < 0:
+            index += len(self.data)
+        if not 0 <= index < len(self.data):
+            raise IndexError("history index out of range")
+        terminal = copy.deepcopy(self._base)
+        for i, data in enumerate(self.data):
+            terminal.feed(data)
+            if i == index:
+                return list(terminal.display)
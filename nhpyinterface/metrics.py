@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:48:09 2026
+
+@author: dandrews
+
+Opt in per environment timing and counters. An interface with metrics set
+to a Metrics times its stages with monotonic clock spans into histograms
+and counts round trips, bytes received, prompts cleared, timeouts and
+reconnects. With metrics left as None the only cost is a None check.
+    nhi.metrics = Metrics()
+    with nhi.span('clear_more'):
+        ...
+    print(to_prometheus({nhi.username: nhi.metrics.snapshot()}))
+"""
+from collections import Counter
+import bisect
+import time
+
+# Upper bounds in seconds, the last bucket is +Inf
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram():
+    """
+    Fixed bucket histogram, counts[i] is the number of values <= bounds[i]
+    and above the bound before, counts[-1] those above every bound.
+    """
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return {'bounds': list(self.bounds), 'counts': list(self.counts),
+                'sum': self.sum, 'count': self.count}
+
+
+class Span():
+    """
+    Context manager observing the seconds spent inside it.
+    """
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start)
+        return False
+
+
+class NullSpan():
+    """
+    Span stand in for when metrics are off.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Metrics():
+    """
+    Counters and per stage histograms of one environment. Not locked, it
+    is only written from the environment's own thread or event loop, take
+    snapshots between steps.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counters = Counter()
+        self.histograms = {}
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(self.buckets)
+        return histogram
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def span(self, name):
+        return Span(self.histogram(name))
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+    def snapshot(self):
+        """
+        {'counters': {name: value}, 'histograms': {name: histogram}} of
+        plain values, safe to keep or dump as JSON.
+        """
+        return {'counters': dict(self.counters),
+                'histograms': {name: h.snapshot() for name, h in self.histograms.items()}}
+
+
+def merge_snapshots(snapshots):
+    """
+    Sum the counters and histograms of several snapshots into one.
+    Histograms of the same name must share bounds.
+    """
+    counters = Counter()
+    histograms = {}
+    for snapshot in snapshots:
+        counters.update(snapshot['counters'])
+        for name, h in snapshot['histograms'].items():
+            merged = histograms.get(name)
+            if merged is None:
+                histograms[name] = {'bounds': list(h['bounds']), 'counts': list(h['counts']),
+                                    'sum': h['sum'], 'count': h['count']}
+                continue
+            if merged['bounds'] != list(h['bounds']):
+                raise ValueError("Histogram {} has different buckets".format(name))
+            merged['counts'] = [a + b for a, b in zip(merged['counts'], h['counts'])]
+            merged['sum'] += h['sum']
+            merged['count'] += h['count']
+    return {'counters': dict(counters), 'histograms': histograms}
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in labels.items()) + '}'
+
+
+def to_prometheus(snapshots, prefix='nethack', label='env'):
+    """
+    Prometheus text exposition of {label value: snapshot}. Counters are
+    reported per label value as <prefix>_<name>_total, histograms are
+    merged over all of them into <prefix>_stage_seconds by stage.
+    """
+    lines = []
+    names = sorted({name for s in snapshots.values() for name in s['counters']})
+    for name in names:
+        metric = '{}_{}_total'.format(prefix, name)
+        lines.append('# TYPE {} counter'.format(metric))
+        for value, snapshot in snapshots.items():
+            if name in snapshot['counters']:
+                lines.append('{}{} {}'.format(metric, _labels(**{label: value}),
+                                              snapshot['counters'][name]))
+
+    histograms = merge_snapshots(snapshots.values())['histograms']
+    if histograms:
+        metric = '{}_stage_seconds'.format(prefix)
+        lines.append('# TYPE {} histogram'.format(metric))
+    for stage in sorted(histograms):
+        h = histograms[stage]
+        cumulative = 0
+        for bound, count in zip(h['bounds'] + ['+Inf'], h['counts']):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(metric, _labels(stage=stage, le=bound), cumulative))
+        lines.append('{}_sum{} {}'.format(metric, _labels(stage=stage), h['sum']))
+        lines.append('{}_count{} {}'.format(metric, _labels(stage=stage), h['count']))
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    import timeit
+
+#%%
+    def time_overhead(reps=1000000):
+        """
+        Per use cost of a span and a count, enabled and disabled.
+        """
+        metrics = Metrics()
+        def enabled():
+            with metrics.span('stage'):
+                pass
+            metrics.count('round_trips')
+        off = None
+        def disabled():
+            with NULL_SPAN:
+                pass
+            if off is not None:
+                off.count('round_trips')
+        for name, func in [('enabled', enabled), ('disabled', disabled)]:
+            print("{}: {:.0f} ns".format(name, timeit.timeit(func, number=reps) / reps * 1e9))
+
+    time_overhead()
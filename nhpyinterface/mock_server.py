@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:02:18 2026
+
+@author: dandrews
+
+A stand in for a dgamelaunch NetHack host, for load and latency tests of
+the client without a game server. It speaks enough of the dgamelaunch
+menus (login, play, quit) and of the game (moves, G rushes, save, #quit)
+for NhInterface and NhEnv, answering with vt_tiledata frames built from
+NhData.SAMPLE_DATA. Every response is delayed by latency +- jitter.
+    server = MockServer(latency=0.005, jitter=0.002)
+    server.start_in_thread()
+    NhInterface.game_address, NhInterface.game_port = server.host, server.port
+"""
+from nhdata import NhData
+import asyncio
+import random
+import re
+import threading
+
+MENU_PROMPT = b'\x1b[19;3H=> '
+INPUT_WAIT = b'\x1b[3z'
+FLOOR = b'\x1b[0;848z.\x1b[1z'
+PLAYER = b'\x1b[0;340z@\x1b[1z'
+# Direction digits to (dx, dy), numpad layout
+MOVES = {b'1': (-1, 1), b'2': (0, 1), b'3': (1, 1), b'4': (-1, 0),
+         b'6': (1, 0), b'7': (-1, -1), b'8': (0, -1), b'9': (1, -1)}
+
+
+def _menu(username=None):
+    lines = [b'\x1b[H\x1b[2J\x1b[2;3H## mock NetHack server',
+             b'\x1b[4;3H## dgamelaunch 1.5.1 - network console game launcher']
+    if username is None:
+        lines += [b'\x1b[10;3HNot logged in.',
+                  b'\x1b[12;3Hl) Login', b'\x1b[13;3Hr) Register new user',
+                  b'\x1b[14;3Hq) Quit']
+    else:
+        lines += [b'\x1b[10;3HLogged in as: ' + username,
+                  b'\x1b[16;3Hp) Play NetHack 3.6.1', b'\x1b[17;3Hq) Quit']
+    return b''.join(lines) + MENU_PROMPT
+
+
+def _line_prompt(text):
+    return b'\x1b[H\x1b[2J\x1b[6;2H' + text + b'\r\x1b[8d =>'
+
+
+class MockSession():
+    """
+    One client's dgamelaunch and game state. feed() takes the bytes the
+    client sent and returns the responses to send back, one per key the
+    game would have waited on.
+    """
+    start_x, start_y = 22, 19 # 1 based, where SAMPLE_DATA leaves the player
+    room = 5 # the player stays within this many cells of the start
+
+    def __init__(self):
+        self.username = None
+        self.state = 'menu'
+        self.line = b''
+        self.line_state = None
+        self.closed = False
+
+    def greeting(self):
+        """
+        What the server sends on connect, the dgamelaunch menu.
+        """
+        return _menu(self.username)
+
+    def feed(self, data):
+        responses = []
+        for key in data:
+            response = self._key(bytes([key]))
+            if response:
+                responses.append(response)
+        return responses
+
+    def _key(self, key):
+        if self.state in ('login', 'password', 'register', 'extended', 'quit'):
+            return self._line_key(key)
+        return getattr(self, '_' + self.state)(key)
+
+    def _line_key(self, key):
+        if key in b'\r\n':
+            line, self.line = self.line, b''
+            return self._line_done(line)
+        self.line += key
+        if self.state in ('extended', 'quit'):
+            return key + INPUT_WAIT # the game's getlin waits for every key
+        return key
+
+    def _line_done(self, line):
+        state = self.state
+        if state == 'login':
+            self.username = line
+            self.state = 'password'
+            return _line_prompt(b'Please enter your password.')
+        if state == 'password':
+            self.state = 'menu'
+            return _menu(self.username)
+        if state == 'register':
+            self.line_state = (self.line_state or 0) + 1
+            if self.line_state >= 4:
+                self.line_state = None
+                self.state = 'menu'
+                return _menu(self.username)
+            return _line_prompt(b'Please enter the next registration detail.')
+        if state == 'quit':
+            if line == b'yes':
+                self.state = 'end'
+                return (b'\x1b[H\x1b[2J\x1b[2;1HGoodbye ' + self.username +
+                        b' the Valkyrie...\x1b[4;1HYou quit on dungeon level 1. (end) ' + INPUT_WAIT)
+            self.state = 'game'
+            return b'\x1b[H\x1b[K' + self._cursor() + INPUT_WAIT
+        # extended command
+        if line == b'quit':
+            self.state = 'quit'
+            return b'\x1b[H\x1b[KReally quit? [yes/no]? ' + INPUT_WAIT
+        self.state = 'game'
+        return b'\x1b[H\x1b[KUnknown extended command.' + self._cursor() + INPUT_WAIT
+
+    def _menu(self, key):
+        if key == b'q':
+            self.closed = True
+            return None
+        if key == b'l' and self.username is None:
+            self.state = 'login'
+            return _line_prompt(b'Please enter your username. (blank entry aborts)')
+        if key == b'r' and self.username is None:
+            self.state = 'register'
+            self.username = b'new'
+            return _line_prompt(b'Please enter your username.')
+        if key == b'p' and self.username is not None:
+            self.state = 'intro'
+            self.turn = 1
+            self.x, self.y = self.start_x, self.start_y
+            return NhData.SAMPLE_DATA[3]
+        return _menu(self.username)
+
+    def _intro(self, key):
+        self.state = 'game'
+        return self._game_screen()
+
+    def _game_screen(self):
+        frame = NhData.SAMPLE_DATA[4].replace(b'Velkommen aa,', b'Velkommen ' + self.username + b',')
+        return re.sub(rb'T:\d+', b'T:%d' % self.turn, frame)
+
+    def _cursor(self):
+        return b'\x1b[%d;%dH' % (self.y, self.x)
+
+    def _status(self):
+        return (b'\x1b[24;1HDlvl:1  $:0  HP:18(18) Pw:1(1) AC:6  Xp:1/0 T:%d\x1b[K'
+                % self.turn)
+
+    def _move(self, dx, dy, steps=1):
+        frame = self._cursor() + FLOOR
+        for _ in range(steps):
+            x, y = self.x + dx, self.y + dy
+            if abs(x - self.start_x) > self.room or abs(y - self.start_y) > self.room:
+                break
+            self.x, self.y = x, y
+            self.turn += 1
+        return frame + self._cursor() + PLAYER + self._status() + self._cursor() + INPUT_WAIT
+
+    def _game(self, key):
+        if key == b'S':
+            self.state = 'save'
+            return b'\x1b[H\x1b[KReally save? [yn] (n) ' + INPUT_WAIT
+        if key == b'G':
+            self.state = 'rush'
+            return INPUT_WAIT
+        if key == b'#':
+            self.state = 'extended'
+            return b'\x1b[H\x1b[K# ' + INPUT_WAIT
+        if key in MOVES:
+            return self._move(*MOVES[key])
+        if key not in b'\r\n':
+            self.turn += 1 # search, wait and everything else take a turn
+        return b'\x1b[H\x1b[K' + self._status() + self._cursor() + INPUT_WAIT
+
+    def _rush(self, key):
+        self.state = 'game'
+        if key in MOVES:
+            return self._move(*MOVES[key], steps=self.room)
+        return self._game(key)
+
+    def _save(self, key):
+        if key == b'y':
+            self.state = 'menu'
+            return b'\x1b[H\x1b[KBe seeing you...' + _menu(self.username)
+        self.state = 'game'
+        return b'\x1b[H\x1b[K' + self._cursor() + INPUT_WAIT
+
+    def _end(self, key):
+        self.state = 'menu'
+        return _menu(self.username)
+
+
+class MockServer():
+    """
+    asyncio telnet server running a MockSession per connection. Use
+    start() on a running loop, or start_in_thread() to serve from a
+    background thread for blocking clients.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.sessions = 0
+        self.responses = 0
+        self._server = None
+        self._handlers = set()
+        self._loop = None
+        self._thread = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    def _delay(self):
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    async def _send(self, writer, data):
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        writer.write(data)
+        await writer.drain()
+        self.responses += 1
+
+    async def _handle(self, reader, writer):
+        self.sessions += 1
+        self._handlers.add(asyncio.current_task())
+        session = MockSession()
+        try:
+            await self._send(writer, session.greeting())
+            while not session.closed:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                for response in session.feed(data):
+                    await self._send(writer, response)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+            self._handlers.discard(asyncio.current_task())
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        handlers = list(self._handlers) # drop the clients still connected
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    def start_in_thread(self):
+        """
+        Serve from an event loop on a daemon thread, returns once listening.
+        """
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.close())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='mock_server', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+
+if __name__ == '__main__':
+    from nh_interface import NhInterface
+    import logging
+    import numpy as np
+    import time
+
+    logging.basicConfig(level=logging.WARNING)
+
+#%%
+    def time_threaded_steps(num, steps=100, latency=0.005, jitter=0.002):
+        """
+        MultiThreadEnvironments steps per second against the mock server,
+        so only the client's cost and the simulated latency are measured.
+        """
+        from threaded_environments import MultiThreadEnvironments
+        server = MockServer(latency=latency, jitter=jitter, seed=0).start_in_thread()
+        NhInterface.game_address, NhInterface.game_port = server.host, server.port
+        for i in num:
+            mte = MultiThreadEnvironments(lambda env: (np.random.randint(1, 10), 0))
+            mte.create_envs(i)
+            mte.reset_all_environments()
+            start = time.monotonic()
+            for _ in range(steps):
+                mte.step_environments()
+            elapsed = time.monotonic() - start
+            print("threads {:5d}: {:8.1f} steps/s, p99 {:.4f} s".format(
+                    i, i * steps / elapsed, mte.get_latency_percentiles()[99]))
+            mte.close()
+        server.stop_thread()
+
+    time_threaded_steps([1, 4, 16, 64])
+
+#%%
+    def time_async_steps(num, steps=100, latency=0.005, jitter=0.002):
+        """
+        AsyncEnvironments steps per second against the mock server on the
+        same event loop, up to a thousand sessions.
+        """
+        from nh_async_environment import AsyncEnvironments
+
+        async def run():
+            server = await MockServer(latency=latency, jitter=jitter, seed=0).start()
+            NhInterface.game_address, NhInterface.game_port = server.host, server.port
+            for i in num:
+                envs = AsyncEnvironments(lambda env: (np.random.randint(1, 10), 0))
+                await envs.create_envs(i, connect_delay=0)
+                await envs.reset_all_environments()
+                start = time.monotonic()
+                for _ in range(steps):
+                    await envs.step_environments()
+                elapsed = time.monotonic() - start
+                print("async {:5d}: {:8.1f} steps/s".format(i, i * steps / elapsed))
+                await envs.close()
+            await server.close()
+
+        asyncio.run(run())
+
+    time_async_steps([1, 10, 100, 1000])
@@ -18,8 +18,42 @@ class Monsters():
         self.minkey = gkeys.min()
         self.maxkey = gkeys.max()
 
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Rebuild from the arrays of to_arrays, without the glyph dict.
+        """
+        monsters = cls.__new__(cls)
+        monsters.names = list(arrays['names'])
+        monsters.monster_data = arrays['monster_data']
+        monsters.data_names = list(arrays['data_names'])
+        monsters.minkey = int(arrays['minkey'])
+        monsters.maxkey = int(arrays['maxkey'])
+        return monsters
+
+    def to_arrays(self):
+        return {'names': np.array(self.names),
+                'monster_data': self.monster_data,
+                'data_names': np.array(self.data_names),
+                'minkey': np.array(self.minkey),
+                'maxkey': np.array(self.maxkey)}
+
     #def is_monster(glyph: int):
 
+    def feature_table(self, num_glyphs):
+        """
+        (num_glyphs, 5) float32 features per glyph, a monster flag then
+        monster_data, zero for anything that is not a monster.
+        """
+        table = np.zeros((num_glyphs, 1 + len(self.data_names)), dtype=np.float32)
+        keys = np.arange(self.minkey, self.maxkey + 1)
+        table[keys, 0] = 1
+        table[keys, 1:] = self.monster_data
+        return table
+
+    @property
+    def feature_names(self):
+        return ['monster'] + ['monster_' + n for n in self.data_names]
 
     def normalize_monster_data(self, glyphs):
         ac = []
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:02:54 2026
+
+@author: dandrews
+
+Asyncio versions of NhEnv and MultiThreadEnvironments so a single event
+loop can drive many games at once.
+"""
+from nh_async_interface import AsyncNhInterface
+from nh_environment import NhEnv
+from nhstate import NhState
+import asyncio
+import inspect
+import logging
+import time
+
+
+class AsyncNhState(NhState):
+    """
+    NhState with the prompt clearing loop awaiting an AsyncNhInterface.
+    """
+
+    async def check_game_state(self):
+        done = False
+        safety = 0
+        threshold = 1000
+        while not done and (self.nhi.is_special_prompt):
+            if safety > threshold:
+                message = ""
+                attribs = dir(self.nhi)
+                for at in [a for a in attribs if 'is_' in a]:
+                    message += ' {}: {}\n'.format(at, getattr(self.nhi, at))
+                raise ValueError("Unexpectedly looping\n" + message)
+            if self.nhi.is_always_no_question:
+                await self.nhi.send_macro('NO')
+            if self.nhi.is_killed or self.nhi.is_dgamelaunch:
+                done = True
+            self._parse_screen()
+            if self.nhi.is_always_yes_question:
+                await self.nhi.send_macro('YES')
+            elif self.nhi.is_always_no_question:
+                await self.nhi.send_macro('NO')
+            else:
+                await self.nhi.send_string('\n')
+            self._save_progress()
+
+            # When fainted there can be a lot of messages to clear.
+            if not self.nhi.is_fainted:
+                safety += 1
+
+        return done
+
+
+class AsyncNhEnv(NhEnv):
+    """
+    NhEnv whose network calls are coroutines. Construct with
+        env = await AsyncNhEnv.create(username)
+    Observations and scoring are shared with NhEnv.
+    """
+
+    def __init__(self, username='aa', observation_dtype=None, observation_mode=None):
+        if len(username) < 2:
+            raise ValueError("Usernames are at least 2 characters")
+        if observation_dtype is not None:
+            self.observation_dtype = observation_dtype
+        if observation_mode is not None:
+            self.observation_mode = observation_mode
+        if self.observation_mode not in self.observation_modes:
+            raise ValueError("Unknown observation mode {}".format(self.observation_mode))
+        self.nhi = AsyncNhInterface(username)
+        self.nhi.set_observation_dtype(self.observation_dtype)
+        self.actions = self.nhi.nhdata.get_commands(1)
+        self.num_actions = len(self.actions)
+        self.nhstate = AsyncNhState(self.nhi)
+
+    @classmethod
+    async def create(cls, username='aa', observation_dtype=None, observation_mode=None):
+        env = cls(username, observation_dtype, observation_mode)
+        env.logger.info("starting user {}".format(username))
+        await env.nhi._connect_with_retry()
+        await env.nhi.start_session()
+        await env.nhi._clear_more()
+        return env
+
+    async def reset(self):
+        """
+        Start a new game
+        """
+        self.logger.info("Reset " + self.nhi.username)
+        await self.nhi.reset_game()
+        self.is_done = False
+        await self.nhi._clear_more()
+        return self.data()
+
+    async def step_with_callback(self, callback):
+        if self.is_done:
+            await self.reset()
+        action, strategy = callback(self)
+        s = self.data()
+        h = self.auxiliary_features()
+        s_, r, t, info = await self.step(action,strategy)
+        return s, action, r, s_, t, h
+
+    async def step(self, action: int, strategy: int = 0):
+        assert type(action) == int
+        assert type(strategy) == int
+        await self.nhi._clear_more()
+        if self.is_done:
+            raise ValueError("Simulation ended and must be reset")
+        self.last_status = self.nhi.get_status()
+        self.last_screen = self.nhi.buffer_to_rgb()
+
+        start_turn = self.nhi.get_status()['t']
+
+        if self.strategies[strategy] == 'explore':
+           await self._do_exploration_move(action)
+        else:
+            await self._do_direct_action(action)
+
+        with self.nhi.span('check_game_state'):
+            self.is_done = await self.nhstate.check_game_state()
+
+        s_, info = self.data(),  self.get_info()
+        r = self.score_move()
+        turn = self.nhi.get_status()['t']
+
+        # turn no-ops like wall bumps into a "search" action
+        if turn == start_turn:
+            await self._do_direct_action(5)
+            turn = self.nhi.get_status()['t']
+        self.logger.info("{} turn {}".format(self.nhi.username,turn))
+        if int(turn) < 1 and not self.is_done:
+            self.is_done = True
+
+        t = self.is_done
+        return s_, r, t, info
+
+    async def _do_direct_action(self, action):
+        if action >= self.num_actions:
+            raise ValueError('No such action {}, limit is {}'.format(action, self.num_actions-1))
+        if action not in self.nhi.nhdata.MOVE_COMMANDS:
+            action = 10 # wait
+        await self.nhi.send_command(action)
+
+    async def _do_exploration_move(self, action):
+        if action not in self.nhi.nhdata.MOVE_COMMANDS:
+            # No op
+            return
+        else:
+           await self.nhi.send_macro(self.nhi.nhdata.get_explore_macro(action).name)
+
+    async def close(self):
+        return await self.nhi.close()
+
+
+class AsyncEnvironments():
+    """
+    Asyncio counterpart of MultiThreadEnvironments. All environments are
+    stepped concurrently on the running event loop.
+    """
+    logger = logging.getLogger()
+    timeout = 300
+
+    def __init__(self, callback):
+        """
+        The callback function must take an NhEnv as an argument and
+        return a tuple of (action,strategy)
+        """
+        assert inspect.isfunction(callback) or inspect.ismethod(callback)
+        self.callback = callback
+        self.envs = []
+
+    async def _gather(self, coros):
+        return await asyncio.wait_for(asyncio.gather(*coros), self.timeout)
+
+    async def create_envs(self, num, connect_delay=0.1):
+        tasks = []
+        for i in range(num):
+            name = 'bot{:03}'.format(i)
+            tasks.append(asyncio.ensure_future(AsyncNhEnv.create(name)))
+            await asyncio.sleep(connect_delay) # don't hit throttles
+        envs = []
+        for result in await self._gather_exceptions(tasks):
+            if isinstance(result, Exception):
+                self.logger.error("create env exception {}".format(result))
+            else:
+                envs.append(result)
+        self.envs = envs
+
+    async def _gather_exceptions(self, tasks):
+        return await asyncio.wait_for(
+                asyncio.gather(*tasks, return_exceptions=True), self.timeout)
+
+    async def step_environments(self):
+        if not self.envs:
+            raise ValueError("Must call create_envs first")
+        envs = [e for e in self.envs if not e.is_done]
+        results = await self._gather(e.step_with_callback(self.callback) for e in envs)
+        return dict(zip(envs, results))
+
+    async def reset_all_environments(self):
+        if not self.envs:
+            raise ValueError("Must call create_envs first")
+        results = await self._gather(e.reset() for e in self.envs)
+        return dict(zip(self.envs, results))
+
+    async def reset_done_environments(self):
+        if not self.envs:
+            raise ValueError("Must call create_envs first")
+        envs = [e for e in self.envs if e.is_done]
+        results = await self._gather(e.reset() for e in envs)
+        return dict(zip(envs, results))
+
+    async def close(self):
+        await self._gather_exceptions([e.close() for e in self.envs])
+
+    def get_env_turns(self):
+        out_dict = {}
+        for e in self.envs:
+            out_dict[e.nhi.username] = e.nhi.get_status()['t']
+        return out_dict
+
+
+if __name__ == '__main__':
+    import numpy as np
+
+    log_format ='(%(threadName)-0s) %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s'
+    logging.basicConfig(level=logging.WARNING, format=log_format)
+
+    def test_callback(data):
+        return (np.random.randint(10),0)
+
+#%%
+    async def time_steps(num, steps=100):
+        results = {}
+        for i in num:
+            envs = AsyncEnvironments(test_callback)
+            await envs.create_envs(i)
+            await envs.reset_done_environments()
+            start = time.monotonic()
+            for _ in range(steps):
+                await envs.step_environments()
+            elapsed = time.monotonic() - start
+            print(i, elapsed)
+            results[i] = elapsed
+            await envs.close()
+        return results
+
+    data = asyncio.run(time_steps([1, 2, 4, 8, 16, 32, 64, 128, 256]))
+    for d in data:
+            print("{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}".format(d, data[d], d * 100, (d*100)/data[d]))
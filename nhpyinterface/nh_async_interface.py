@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:12:37 2026
+
+@author: dandrews
+
+Asyncio version of NhInterface. One event loop can hold hundreds of game
+sessions without a thread per connection, and it does not need telnetlib
+which is gone from newer versions of Python.
+"""
+from nh_interface import NhInterface
+import asyncio
+import time
+
+IAC  = bytes([255]) # Interpret As Command
+DONT = bytes([254])
+DO   = bytes([253])
+WONT = bytes([252])
+WILL = bytes([251])
+SB   = bytes([250]) # Subnegotiation Begin
+SE   = bytes([240]) # Subnegotiation End
+NULL = bytes([0])
+XON  = bytes([17])
+
+
+class AsyncTelnet(asyncio.Protocol):
+    """
+    Minimal telnet client on an asyncio transport with the subset of the
+    telnetlib.Telnet API NhInterface uses. Option negotiation is refused the
+    same way telnetlib does by default.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.cookedq = b''
+        self.eof = False
+        self._iacseq = b''
+        self._sb = False
+        self._data_ready = asyncio.Event()
+
+    @classmethod
+    async def open(cls, host, port=23):
+        loop = asyncio.get_running_loop()
+        _, protocol = await loop.create_connection(cls, host, port)
+        return protocol
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.eof = True
+        self._data_ready.set()
+
+    def data_received(self, data):
+        self.cookedq += self._process_raw(data)
+        self._data_ready.set()
+
+    def _process_raw(self, data):
+        """
+        Strip telnet commands out of the raw data and answer DO/WILL requests
+        with WONT/DONT. Partial sequences are kept for the next packet.
+        """
+        buf = bytearray()
+        for c in data:
+            c = bytes([c])
+            if not self._iacseq:
+                if c == IAC:
+                    self._iacseq = c
+                elif self._sb or c == NULL or c == XON:
+                    continue
+                else:
+                    buf += c
+            elif len(self._iacseq) == 1:
+                if c in (DO, DONT, WILL, WONT):
+                    self._iacseq += c
+                    continue
+                self._iacseq = b''
+                if c == IAC:
+                    if not self._sb:
+                        buf += c
+                elif c == SB:
+                    self._sb = True
+                elif c == SE:
+                    self._sb = False
+            else:
+                cmd = self._iacseq[1:2]
+                self._iacseq = b''
+                if cmd in (DO, DONT):
+                    self.transport.write(IAC + WONT + c)
+                else:
+                    self.transport.write(IAC + DONT + c)
+        return bytes(buf)
+
+    def write(self, buffer):
+        if self.transport is None or self.transport.is_closing():
+            raise EOFError("telnet connection closed")
+        self.transport.write(buffer.replace(IAC, IAC + IAC))
+
+    async def _wait_data(self, deadline):
+        """
+        Wait for more data until the loop time deadline, False if none came.
+        """
+        if self.eof:
+            return False
+        loop = asyncio.get_running_loop()
+        remaining = None if deadline is None else deadline - loop.time()
+        if remaining is not None and remaining <= 0:
+            return False
+        self._data_ready.clear()
+        try:
+            await asyncio.wait_for(self._data_ready.wait(), remaining)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _deadline(self, timeout):
+        return None if timeout is None else asyncio.get_running_loop().time() + timeout
+
+    async def read_until(self, match, timeout=None):
+        """
+        Read until match is found or until timeout, same as telnetlib.
+        """
+        deadline = self._deadline(timeout)
+        while True:
+            i = self.cookedq.find(match)
+            if i >= 0:
+                i += len(match)
+                buf = self.cookedq[:i]
+                self.cookedq = self.cookedq[i:]
+                return buf
+            if not await self._wait_data(deadline):
+                break
+        return self.read_very_lazy()
+
+    async def expect(self, patterns, timeout=None):
+        """
+        Read until one of the compiled patterns matches, same as telnetlib.
+        Returns (index, match, data), index -1 on timeout.
+        """
+        deadline = self._deadline(timeout)
+        while True:
+            for i, pattern in enumerate(patterns):
+                m = pattern.search(self.cookedq)
+                if m:
+                    buf = self.cookedq[:m.end()]
+                    self.cookedq = self.cookedq[m.end():]
+                    return (i, m, buf)
+            if not await self._wait_data(deadline):
+                break
+        return (-1, None, self.read_very_lazy())
+
+    async def read_very_eager(self):
+        """
+        Read everything that is available without waiting on the network.
+        """
+        await asyncio.sleep(0) # let pending data_received callbacks run
+        return self.read_very_lazy()
+
+    def read_very_lazy(self):
+        buf = self.cookedq
+        self.cookedq = b''
+        if not buf and self.eof:
+            raise EOFError("telnet connection closed")
+        return buf
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        self.eof = True
+
+
+class AsyncNhInterface(NhInterface):
+    """
+    NhInterface over asyncio. Construct with
+        nhi = await AsyncNhInterface.create(username)
+    and await the network methods. Screen parsing, states and observations
+    are shared with NhInterface.
+    """
+
+    def __init__(self, username='aa'):
+        self.username = username
+        self._init_screen()
+        self._init_history()
+        self.tn = None
+
+    def __del__(self):
+        if self.tn:
+            self.tn.close()
+        self.stop_recording()
+
+    @classmethod
+    async def create(cls, username='aa'):
+        nhi = cls(username)
+        await nhi._connect_with_retry()
+        return nhi
+
+    async def start_session(self):
+        self.logger.info('(re)start session ' + self.username)
+
+        if not self.tn:
+            self.logger.debug('connect session ' + self.username)
+            self.count('reconnects')
+            await self._connect_with_retry()
+
+        await self._clear_more()
+        if not self.is_dgamelaunch:
+            self.logger.debug('Not in dgamelaunch menu ' +  self.username)
+            return
+        prompt = b'=>'
+        if not self.is_dg_logged_in or self.is_game_screen:
+            self.logger.info('log in ' + self.username)
+            if prompt.decode() not in " ".join(self.get_display()):
+                self._feed(await self._read_response(prompt, 2))
+            await self.send_and_read_to_prompt(prompt, b'l')
+            message = self.username.encode(self.encoding) + b'\n'
+            await self.send_and_read_to_prompt(prompt, message)
+            await self.send_and_read_to_prompt(prompt, message)
+        await self.send_and_read_to_prompt(prompt, b'p') # play
+        await self._clear_more()
+
+        # Important not to send anything while stale processes are being killed
+        while self.is_stale:
+            self.logger.info("stale " + self.username)
+            data = await self._read_response(b'seconds.', 1)
+            self._feed(data)
+            await self._read_states()
+        self._feed(await self._read_response(self._more_prompt, 1))
+        await self._clear_more()
+
+    async def reset_game(self):
+        self.logger.info('Resetting ' + self.username)
+
+        if not self.tn:
+            self.count('reconnects')
+            await self._connect_with_retry()
+            await self._read_states()
+
+        await self._clear_more()
+
+        t = self.get_status()['t']
+        if self.is_game_screen and t != 1:
+            await self.send_keys(b'#quit\n', b'[yes/no]?')
+            await self.send_keys(b'yes\n', b'(end)')
+            await self._clear_more()
+
+        await self.start_session()
+
+    async def _clear_more(self):
+        with self.span('clear_more'):
+            await self._read_states()
+            while self.is_end or self.is_more\
+                or self.is_blank or self.is_call_prompt\
+                or self.is_entry_problem:
+                self.logger.debug('clearing prompts')
+                self.count('prompts_cleared')
+                await self.send_and_read_to_prompt(self._more_prompt, b'\n')
+
+    async def send_and_read_to_prompt(self, prompt, message, timeout=2):
+        if type(prompt) == str:
+            prompt = prompt.encode('ascii')
+
+        if type(message) == str:
+            message = message.encode('ascii')
+
+        if not self.tn:
+            await self.start_session()
+
+        try:
+            start = time.monotonic()
+            self.tn.write(message)
+            data = await self._read_response(prompt, timeout)
+            self._record_latency(message, start)
+            self._feed(data, message)
+        except EOFError:
+           self.logger.warning("Telnet connection lost")
+           self.tn = None
+           return b''
+        await self._read_states()
+        return data
+
+    async def close(self):
+        if self.tn:
+            if self.is_game_screen:
+                await self.send_macro('SAVE')
+            else:
+                await self.send_string('q')
+            if self.tn:
+                self.tn.close()
+            self.tn = None
+        self.stop_recording()
+        if self.history_buffer is not None:
+            self.history_buffer.close()
+        return ("closed " + self.username)
+
+    async def _connect_with_retry(self):
+        retries = 0
+        limit = 3
+        while retries < limit:
+            try:
+                self.logger.debug("Connection to {} retry {}".format(self.game_address, retries))
+                self.tn = await AsyncTelnet.open(self.game_address, self.game_port)
+                data = await self._read_response(b'\x1b[19;3H=> ', 2)
+                self._feed(data)
+                return
+            except ConnectionRefusedError:
+                retries += 1
+                self.count('connect_retries')
+                await asyncio.sleep(1 * retries)
+        self.logger.warning("{} connection refused".format(self.username))
+        raise ConnectionRefusedError
+
+    async def _read_response(self, prompt, timeout):
+        if not prompt:
+            return await self.tn.read_very_eager()
+        index, _, data = await self.tn.expect(self._response_patterns(prompt), timeout)
+        if index < 0:
+            self._timed_out()
+            self.logger.debug("{} timed out waiting for {}".format(self.username, prompt))
+        return data + await self.tn.read_very_eager()
+
+    async def _read_states(self):
+        if not self.tn:
+            self.logger.warning("{} unexpectedly lost connection.".format(self.username))
+            await self.start_session()
+        try:
+            data = await self.tn.read_very_eager()
+        except EOFError:
+            self.logger.warning("Telnet connection lost")
+            self.tn = None
+            data = b''
+        self._feed(data)
+        self._parse_states()
+
+    async def send_command(self, action_num):
+        command = self.nhdata.COMMANDS[action_num]
+        data = command.command
+        await self.send_and_read_to_prompt(b'\x1b[3z', data.encode('ascii'))
+
+    async def send_keys(self, keys, prompt=NhInterface.INPUT_WAIT, timeout=2):
+        if type(prompt) == str:
+            prompt = prompt.encode('ascii')
+
+        if type(keys) == str:
+            keys = keys.encode('ascii')
+
+        if not self.tn:
+            await self.start_session()
+
+        data = b''
+        try:
+            start = time.monotonic()
+            self.tn.write(keys)
+            patterns = self._response_patterns(prompt)
+            for waits in range(1, len(keys) + 1):
+                index, _, chunk = await self.tn.expect(patterns, timeout)
+                self._feed(chunk, b'' if data else keys)
+                data += chunk
+                if index < 0:
+                    self._timed_out()
+                    self.logger.debug("{} timed out on keys {}".format(self.username, keys))
+                if index != 0 or waits == len(keys):
+                    break
+            self._record_latency(keys, start)
+            chunk = await self.tn.read_very_eager()
+            self._feed(chunk)
+            data += chunk
+        except EOFError:
+           self.logger.warning("Telnet connection lost")
+           self.tn = None
+           return data
+        await self._read_states()
+        return data
+
+    async def send_macro(self, name):
+        macro = self.nhdata.MACROS[name]
+        return await self.send_keys(macro.keys, macro.prompt)
+
+    async def send_string(self, string):
+        await self.send_and_read_to_prompt(b'\x1b[3z', string)
+
+
+if __name__ == '__main__':
+    import logging
+    log_format ='(%(threadName)-0s) %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s'
+    logging.basicConfig(level=logging.WARNING, format=log_format)
+
+#%%
+    async def smoke_test():
+        nhi = await AsyncNhInterface.create()
+        await nhi.start_session()
+        start = time.monotonic()
+        await nhi.send_string(".")
+        print("round trip {:.3f}s".format(time.monotonic() - start))
+        print("\n".join(nhi.screen.display))
+        await nhi.close()
+
+    asyncio.run(smoke_test())
@@ -11,13 +11,40 @@ from nh_interface import NhInterface
 from nhstate import NhState
 from collections import namedtuple
 import numpy as np
-import skimage.transform
 import logging
 
 
 
 Aspace = namedtuple("action_space", "n")
 
+
+class NearestResizer():
+    """
+    Nearest neighbour resize from one fixed shape to another. The source
+    index of every output element is worked out once, after that a resize
+    is a single np.take, sampling input floor((i + 0.5) * in / out). When
+    no axis shrinks, like 21x80 to 84x84, this matches
+    skimage.transform.resize(order=0, mode='constant'). skimage smooths
+    axes it downsamples first, so shrinking shapes differ from it.
+    """
+    def __init__(self, input_shape, output_shape):
+        self.input_shape = tuple(input_shape)
+        self.output_shape = tuple(output_shape)
+        axes = [((2 * np.arange(o) + 1) * i) // (2 * o)
+                for i, o in zip(self.input_shape, self.output_shape)]
+        self.flat_index = np.ravel_multi_index(np.ix_(*axes), self.input_shape)
+
+    def __call__(self, state, out=None):
+        """
+        Resize one state, or a batch of them stacked on the first axis.
+        out may be preallocated and of another dtype.
+        """
+        state = np.asarray(state)
+        if state.shape == self.input_shape:
+            return np.take(state.reshape(-1), self.flat_index, out=out)
+        flat = state.reshape(state.shape[0], -1)
+        return np.take(flat, self.flat_index, axis=1, out=out)
+
 class NhEnv():
     """
     More or less replicate an AI Gym environment for connecting to a NN.
@@ -34,12 +61,25 @@ class NhEnv():
     # Model's expected image size
     output_shape = [84,84,3]
     last_turn = 0
-
-    def __init__(self, username='aa'):
+    _resizers = {}
+    # np.uint8 observations are 1/8 the size of float64, scaled 0-255
+    observation_dtype = np.float64
+    # 'rgb' resized to output_shape, or 'features' (F, 21, 80) float32 planes
+    observation_mode = 'rgb'
+    observation_modes = ['rgb', 'features']
+
+    def __init__(self, username='aa', observation_dtype=None, observation_mode=None):
         if len(username) < 2:
             raise ValueError("Usernames are at least 2 characters")
+        if observation_dtype is not None:
+            self.observation_dtype = observation_dtype
+        if observation_mode is not None:
+            self.observation_mode = observation_mode
+        if self.observation_mode not in self.observation_modes:
+            raise ValueError("Unknown observation mode {}".format(self.observation_mode))
         self.logger.info("starting user {}".format(username))
         self.nhi = NhInterface(username)
+        self.nhi.set_observation_dtype(self.observation_dtype)
         self.actions = self.nhi.nhdata.get_commands(1)
         self.num_actions = len(self.actions)
         self.nhstate = NhState(self.nhi)
@@ -70,8 +110,28 @@ class NhEnv():
         s_, r, t, info = self.step(action,strategy)
         return s, action, r, s_, t, h
 
+    def step_into(self, callback, batch, slot, index):
+        """
+        Same as step_with_callback but the results are written into this
+        environment's place in a BatchBuffer instead of being returned.
+        Observations are resized straight into the buffer, no array is
+        allocated or copied for them.
+        """
+        if self.is_done:
+            self.reset()
+        action, strategy = callback(self)
+        if batch.s is not None:
+            self.data(batch.s[slot, index])
+        h = self.auxiliary_features()
+        _, r, t, info = self.step(action, strategy, batch.s_[slot, index])
+        batch.store(slot, index, None, action, r, None, t, h)
 
-    def step(self, action: int, strategy: int = 0):
+
+    def step(self, action: int, strategy: int = 0, out=None):
+        """
+        out, if given, is a preallocated array the next observation is
+        written into and returned as s_.
+        """
         assert type(action) == int
         assert type(strategy) == int
         self.nhi._clear_more()
@@ -87,10 +147,11 @@ class NhEnv():
         else:
             self._do_direct_action(action)
 
-        self.is_done = self.nhstate.check_game_state()
+        with self.nhi.span('check_game_state'):
+            self.is_done = self.nhstate.check_game_state()
 
         #s_, r, t, info
-        s_, info = self.data(),  self.get_info()
+        s_, info = self.data(out),  self.get_info()
         r = self.score_move()
         turn = self.nhi.get_status()['t']
 
@@ -133,12 +194,13 @@ class NhEnv():
                 score += explore / 50.0 # Scale the score to be approx 0-1
 
             if score_status:
-                for key in new_status:
-                    if key in self.last_status.keys() and key is not 'hp':
+                keys = new_status.dtype.names
+                for key in keys:
+                    if key != 'hp':
                         if self.last_status[key] < new_status[key]:
-                            score += 1 / len(new_status.keys())
+                            score += 1 / len(keys)
                         if self.last_status[key] > new_status[key]:
-                            score -= 1 / len(new_status.keys())
+                            score -= 1 / len(keys)
 
             if score_hp:
                 hp = int(new_status['hp'])
@@ -163,17 +225,41 @@ class NhEnv():
             # No op
             return
         else:
-           self.nhi.send_string("G")
-           self.nhi.send_string(str(action))
+           self.nhi.send_macro(self.nhi.nhdata.get_explore_macro(action).name)
 
-    def data(self):
-        return self.resize_state(self.nhi.buffer_to_rgb())
+    @property
+    def observation_shape(self):
+        if self.observation_mode == 'features':
+            return (len(self.nhi.nhdata.feature_names) + 1,) + self.nhi.npdata.shape
+        return tuple(self.output_shape)
 
-
-    def resize_state(self, state):
-        newsize = np.array(self.output_shape) # imresize prefers np.ndarray
-        a = skimage.transform.resize(state, newsize, mode='constant', order=0)
-        return a
+    def data(self, out=None):
+        """
+        The observation of the current screen, written into out if given.
+        """
+        with self.nhi.span('data'):
+            if self.observation_mode == 'features':
+                return self.nhi.buffer_to_features(out)
+            if out is not None:
+                return self.resize_state(self.nhi.rgb, out)
+            # Resizing makes a new array, so read the live rgb without a copy
+            return self.nhi.get_cached('observation',
+                                       lambda: self.resize_state(self.nhi.rgb))
+
+    def get_resizer(self, input_shape):
+        key = (tuple(input_shape), tuple(self.output_shape))
+        if key not in self._resizers:
+            self._resizers[key] = NearestResizer(*key)
+        return self._resizers[key]
+
+    def resize_state(self, state, out=None):
+        return self.get_resizer(np.shape(state))(state, out)
+
+    def resize_states(self, states, out=None):
+        """
+        Resize a batch of states stacked on the first axis in one gather.
+        """
+        return self.get_resizer(np.shape(states)[1:])(states, out)
 
     def close(self):
         self.nhi.close()
@@ -208,3 +294,29 @@ if __name__ == '__main__':
     #%prun test_step_function(nhe, 100)
 
 
+
+#%%
+    def import_time(module='nh_environment', heaviest=10):
+        """
+        python -X importtime of a module in a fresh interpreter. Prints the
+        total, the slowest imports and any plotting libraries pulled in.
+        """
+        import os
+        import subprocess
+        import sys
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        imports = []
+        for line in result.stderr.splitlines()[1:]:
+            _, cumulative, name = line.split('|')
+            imports.append((int(cumulative), name.rstrip()))
+        # Nesting is shown by indentation, top level imports have one space
+        total = sum(c for c, name in imports if not name.startswith('  '))
+        print("import {}: {:.1f} ms".format(module, total / 1000))
+        for cumulative, name in sorted(imports, reverse=True)[:heaviest]:
+            print("{:8.1f} ms {}".format(cumulative / 1000, name))
+        heavy = {name.strip() for _, name in imports} & {'matplotlib', 'skimage', 'scipy', 'pyte'}
+        print("heavy imports:", sorted(heavy) or None)
+
+    import_time()
@@ -6,15 +6,17 @@ Created on Mon Jan  8 17:00:26 2018
 
 With inspiration from the lmj nethack client https://github.com/lmjohns3/shrieker
 """
-from pyte import Screen, ByteStream
-import telnetlib
-#from sprites import SpriteSheet
 import numpy as np
-import matplotlib.pyplot as plt
 from nhdata import NhData
+from nh_terminal import NhTerminal
+from recorder import SessionRecorder
+from history import History
+from metrics import Metrics, NULL_SPAN
 import collections
+import enum
 import os
 import logging
+import re
 import time
 
 
@@ -38,32 +40,37 @@ class NhInterface:
     cols = 80
     rows = 24
     encoding = 'ascii'
+    # Keep the last history_size chunks sent and received, see History
     SAVE_HISTORY = False
-    history = []
-    data_history = []
-    command_history = []
+    history_size = 1000
+    history_buffer = None
+    # Parse with NhTerminal straight into arrays instead of pyte
+    NATIVE_TERMINAL = False
     wb_message = b'welcome back to NetHack!'
     MAX_GLYPH = 1012
     map_x_y = MapXY(21,80)
+    # glyph_map row 0 is screen line 1, the top line is for messages
+    map_skiplines = 1
     nhdata = NhData()
     monster_count = len(nhdata.monsters.monster_data)
     tn = None
+    # SessionRecorder every fed chunk of data is appended to, see start_recording
+    recorder = None
     _more_prompt = b'ore--\x1b[27m\x1b[3z'
-    is_always_yes_question = False
-    is_always_no_question  = False
-    is_killed              = False
-    is_end                 = False
-    is_stale               = False
-    is_more                = False
-    is_killed_something    = False
-    is_special_prompt      = False
-    is_game_screen         = False
-    is_blank               = False
-    is_count               = False
-    is_dgamelaunch         = False
-    is_dg_logged_in        = False
-    is_fainted             = False
-    is_call_prompt         = False
+    # vt_tiledata marker the game sends whenever it waits for input. A read
+    # is complete at its prompt or at this marker, whichever comes first.
+    INPUT_WAIT = b'\x1b[3z'
+    _input_wait = re.compile(re.escape(INPUT_WAIT))
+    # (command, seconds) of the last latency_size sends
+    latency_size = 10000
+    read_timeouts = 0
+    # metrics.Metrics of stage timings and counters, None when off. Set
+    # COLLECT_METRICS for every new interface or call enable_metrics.
+    COLLECT_METRICS = False
+    metrics = None
+    # StateFlag bits of the current screen. The is_* attributes, e.g.
+    # is_more or is_special_prompt, are read only views of these bits.
+    states = 0
 
     _special_prompts = ['end', 'more', 'always_yes_question',
                         'always_no_question', 'count',
@@ -94,15 +101,17 @@ class NhInterface:
     sprite_sheet_name = "sprite_sheets/chozo32.bmp"
     local_dir = os.path.abspath(os.path.dirname(__file__))
     sprite_sheet_name = os.path.join(local_dir, sprite_sheet_name)
+    tile_size = 32
+    _sprite_sheet = None
+    _feature_planes = None
+    # dtype of the rgb observation, np.uint8 scales the channels to 0-255
+    observation_dtype = np.float64
 
     def __init__(self, username='aa'):
         self.username = username
-        #self.sprite_sheet = SpriteSheet(self.sprite_sheet_name, 40, 30)
         self._init_screen()
-        self.tn = self._connect_with_retry()
-
-        # Create placeholder for return data that is often updated
-        self.npdata = np.zeros((self.map_x_y.x, self.map_x_y.y), dtype=np.float32)
+        self._init_history()
+        self._connect_with_retry()
 
     def __del__(self):
          self.close()
@@ -112,6 +121,7 @@ class NhInterface:
 
         if not self.tn:
             self.logger.debug('connect session ' + self.username)
+            self.count('reconnects')
             self._connect_with_retry()
 
         self._clear_more()
@@ -121,7 +131,8 @@ class NhInterface:
         prompt = b'=>'
         if not self.is_dg_logged_in or self.is_game_screen:
             self.logger.info('log in ' + self.username)
-            self.tn.read_until(prompt,2)
+            if prompt.decode() not in " ".join(self.get_display()):
+                self._feed(self._read_response(prompt, 2))
             self.send_and_read_to_prompt(prompt, b'l')
             message = self.username.encode(self.encoding) + b'\n'
             self.send_and_read_to_prompt(prompt, message)
@@ -133,19 +144,17 @@ class NhInterface:
         # Ideally won't end up in this loop much outside of testing.
         while self.is_stale:
             self.logger.info("stale " + self.username)
-            data = self.tn.read_until(b'seconds.', 1)
-            self.byte_stream.feed(data)
-            page = self.screen.display
-            if self.SAVE_HISTORY:
-                self.history.append(page)
+            data = self._read_response(b'seconds.', 1)
+            self._feed(data)
             self._read_states()
-        self.tn.read_until(self._more_prompt, 1)
+        self._feed(self._read_response(self._more_prompt, 1))
         self._clear_more()
 
     def reset_game(self):
         self.logger.info('Resetting ' + self.username)
 
         if not self.tn:
+            self.count('reconnects')
             self._connect_with_retry()
             self._read_states()
 
@@ -154,40 +163,50 @@ class NhInterface:
                 self.logger.debug("dgamelaunch " + self.username)
 
 
-        t = self.nhdata.get_status(self.screen.display)['t']
+        t = self.get_status()['t']
         if self.is_game_screen and t != 1:
-            self.send_and_read_to_prompt(b'[yes/no]?', b'#quit\n')
-            self.send_and_read_to_prompt(b'(end)', b'yes\n')
+            self.send_keys(b'#quit\n', b'[yes/no]?')
+            self.send_keys(b'yes\n', b'(end)')
             self._clear_more()
 
         self.start_session()
 
 
     def _clear_more(self):
-        self._read_states()
-        while self.is_end or self.is_more\
-            or self.is_blank or self.is_call_prompt\
-            or self.is_entry_problem:
-            self.logger.debug('clearing prompts')
-            self.send_and_read_to_prompt(self._more_prompt, b'\n')
+        with self.span('clear_more'):
+            self._read_states()
+            while self.is_end or self.is_more\
+                or self.is_blank or self.is_call_prompt\
+                or self.is_entry_problem:
+                self.logger.debug('clearing prompts')
+                self.count('prompts_cleared')
+                self.send_and_read_to_prompt(self._more_prompt, b'\n')
+
+    @property
+    def sprite_sheet(self):
+        """
+        Loaded on first use. The tile atlases behind it are cached per sheet
+        and tile size, so every interface shares one read only copy.
+        """
+        if self._sprite_sheet is None or \
+            self._sprite_sheet.file_name != self.sprite_sheet_name:
+            from sprites import SpriteSheet
+            self._sprite_sheet = SpriteSheet(self.sprite_sheet_name, 40, 30)
+        return self._sprite_sheet
 
-    def render_glyphs(self):
+    def render_glyphs(self, tile_size=None):
         """
-        Creates a three channel numpy array and copies the correct glyphs
-        to the array.
+        Creates a three channel uint8 numpy array of the map tiles, built
+        with one gather from the sprite sheet's tile atlas. tile_size can
+        be any size the sheet is scaled to, e.g. 8, 16 or 32.
 
         Compatible with png and matplotlib
         ex:
             png.from_array(img.tolist(), 'RGB').save('map.png')
         """
-        screen = np.zeros((self.map_x_y.x*32,self.map_x_y.y*32,3))
-        glyphs = self.buffer_to_npdata()
-        for row in range(len(glyphs)):
-            for col in range(len(glyphs[row])):
-                    glyph  = glyphs[row,col]
-                    tile = self.sprite_sheet.get_image_by_number(int(glyph))
-                    screen[row*32:(row*32)+32,col*32:(col*32)+32,:] = tile
-        return screen
+        if tile_size is None:
+            tile_size = self.tile_size
+        return self.sprite_sheet.render(self.buffer_to_npdata(), tile_size)
 
     def send_and_read_to_prompt(self, prompt, message, timeout=2):
         if type(prompt) == str:
@@ -200,43 +219,336 @@ class NhInterface:
             self.start_session()
 
         try:
+            start = time.monotonic()
             self.tn.write(message)
-            data = self.tn.read_until(prompt, timeout)
-            data += self.tn.read_very_eager()
-            self.byte_stream.feed(data)
+            data = self._read_response(prompt, timeout)
+            self._record_latency(message, start)
+            self._feed(data, message)
         except EOFError:
            self.logger.warning("Telnet connection lost")
            self.tn = None
            return b''
         if self.SAVE_HISTORY:
-            self.data_history.append(data)
-            self.command_history.append(message)
-            self.history.append(self.screen.display)
             self.logger.debug(message)
             self.logger.debug("".join(self.screen.display))
         self._read_states()
         return data
 
+    def send_keys(self, keys, prompt=INPUT_WAIT, timeout=2):
+        """
+        Send a key sequence in one write and read until the game has waited
+        for input once per key, or prompt appears. Every key the game reads
+        is followed by an input wait, so all of them are read here even
+        past a --More-- or question, or the next read would complete on a
+        stale one. Prompts are left on screen for the caller.
+        """
+        if type(prompt) == str:
+            prompt = prompt.encode('ascii')
+
+        if type(keys) == str:
+            keys = keys.encode('ascii')
+
+        if not self.tn:
+            self.start_session()
+
+        data = b''
+        try:
+            start = time.monotonic()
+            self.tn.write(keys)
+            patterns = self._response_patterns(prompt)
+            for waits in range(1, len(keys) + 1):
+                index, _, chunk = self.tn.expect(patterns, timeout)
+                # The first chunk carries the command so replays line up
+                self._feed(chunk, b'' if data else keys)
+                data += chunk
+                if index < 0:
+                    self._timed_out()
+                    self.logger.debug("{} timed out on keys {}".format(self.username, keys))
+                if index != 0 or waits == len(keys):
+                    break
+            self._record_latency(keys, start)
+            chunk = self.tn.read_very_eager()
+            self._feed(chunk)
+            data += chunk
+        except EOFError:
+           self.logger.warning("Telnet connection lost")
+           self.tn = None
+           return data
+        self._read_states()
+        return data
+
+    def send_macro(self, name):
+        """
+        Send one of NhData.MACROS with send_keys.
+        """
+        macro = self.nhdata.MACROS[name]
+        return self.send_keys(macro.keys, macro.prompt)
+
     def close(self):
         if self.tn:
             if self.is_game_screen:
-                self.send_string('S')
-                self.send_string('y')
-                self.send_string('\n')
+                self.send_macro('SAVE')
             else:
                 self.send_string('q')
-            self.tn.close()
+            if self.tn:
+                self.tn.close()
             self.tn = None
+        self.stop_recording()
+        if self.history_buffer is not None:
+            self.history_buffer.close()
         return ("closed " + self.username)
 
+    def _init_history(self):
+        if self.SAVE_HISTORY:
+            self.history_buffer = History(self.history_size, self.cols, self.rows)
+        self.latencies = collections.deque(maxlen=self.latency_size)
+        if self.COLLECT_METRICS:
+            self.metrics = Metrics()
+
+    def enable_metrics(self, buckets=None):
+        """
+        Start collecting a metrics.Metrics, with histogram bucket bounds in
+        seconds if given.
+        """
+        self.metrics = Metrics() if buckets is None else Metrics(buckets)
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    def span(self, stage):
+        """
+        Context manager timing stage into the metrics, a no op when off.
+        """
+        if self.metrics is None:
+            return NULL_SPAN
+        return self.metrics.span(stage)
+
+    def count(self, name, value=1):
+        if self.metrics is not None:
+            self.metrics.count(name, value)
+
+    def _record_latency(self, command, start):
+        """
+        Record one round trip that started at monotonic time start.
+        """
+        elapsed = time.monotonic() - start
+        self.latencies.append((command, elapsed))
+        if self.metrics is not None:
+            self.metrics.count('round_trips')
+            self.metrics.observe('network_wait', elapsed)
+
+    def _timed_out(self):
+        self.read_timeouts += 1
+        self.count('timeouts')
+
+    def _response_patterns(self, prompt):
+        patterns = [self._input_wait]
+        if prompt != self.INPUT_WAIT:
+            patterns.append(re.compile(re.escape(prompt)))
+        return patterns
+
+    def _read_response(self, prompt, timeout):
+        """
+        Read until prompt or the input wait marker, whichever is first, plus
+        anything else already received. An empty prompt does not wait.
+        """
+        if not prompt:
+            return self.tn.read_very_eager()
+        index, _, data = self.tn.expect(self._response_patterns(prompt), timeout)
+        if index < 0:
+            self._timed_out()
+            self.logger.debug("{} timed out waiting for {}".format(self.username, prompt))
+        return data + self.tn.read_very_eager()
+
+    def latency_percentiles(self, percentiles=(50, 90, 99), command=None):
+        """
+        {percentile: seconds} from send to complete response over the
+        recorded latencies, optionally for one command only.
+        """
+        times = [t for c, t in self.latencies if command is None or c == command]
+        if not times:
+            return {}
+        return dict(zip(percentiles, np.percentile(times, percentiles)))
+
+    def spill_history(self, file_name, compression=None):
+        """
+        Write entries that fall out of the history, and the rest on close,
+        to a recorder.SessionRecorder file instead of dropping them.
+        """
+        if self.history_buffer is None:
+            raise ValueError("SAVE_HISTORY is off, there is no history to spill")
+        self.history_buffer.spill = SessionRecorder(file_name, compression)
+
+    @property
+    def history(self):
+        """
+        Screens after each chunk of data in the history, rebuilt on demand.
+        """
+        if self.history_buffer is None:
+            return []
+        return list(self.history_buffer.screens())
+
+    @property
+    def data_history(self):
+        return [] if self.history_buffer is None else list(self.history_buffer.data)
+
+    @property
+    def command_history(self):
+        return [] if self.history_buffer is None else list(self.history_buffer.commands)
+
+    def start_recording(self, file_name, compression=None):
+        """
+        Append everything fed from now on, with the commands that caused
+        it, to a recorder.SessionRecorder file. compression is one of
+        recorder.CODECS.
+        """
+        self.stop_recording()
+        self.recorder = SessionRecorder(file_name, compression)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
     def _init_screen(self):
-        self.byte_stream = ByteStream()
-        self.screen = Screen(self.cols,self.rows)
-        self.byte_stream = ByteStream()
-        self.byte_stream.attach(self.screen)
+        if self.NATIVE_TERMINAL:
+            self.screen = NhTerminal(self.cols, self.rows)
+            self.byte_stream = self.screen
+        else:
+            from pyte import Screen, ByteStream
+            self.screen = Screen(self.cols,self.rows)
+            if not hasattr(self.screen, 'glyph_map'):
+                raise ImportError("The installed pyte has no glyph_map, observations "
+                                  "need the vt_tiledata fork of pyte or NATIVE_TERMINAL")
+            self.byte_stream = ByteStream()
+            self.byte_stream.attach(self.screen)
+
+        # Persistent observation, kept current one dirty row at a time.
+        self.npdata = np.zeros((self.map_x_y.x, self.map_x_y.y), dtype=np.int32)
+        self._set_rgb_table(self.observation_dtype)
+        self.rgb = np.zeros((self.map_x_y.x, self.map_x_y.y, 3), dtype=self.observation_dtype)
+        self.changed_cells = np.zeros((self.map_x_y.x, self.map_x_y.y), dtype=bool)
+        self._cursor_cell = None
+        self._status = None
+        self._status_dirty = True
+        self._update_observation()
+        self.changed_cells[:] = False
+
+        # Anything derived from the screen is cached against the generation
+        # so it is computed at most once per distinct screen.
+        self.generation = 0
+        self._frame_cache = {}
+        self.cache_hits = collections.Counter()
+        self.cache_misses = collections.Counter()
+
+    def _feed(self, data, command=b''):
+        """
+        Feed telnet data to the terminal and refresh the rows it touched.
+        command is what was sent to get the data, for the recorder.
+        """
+        if self.recorder is not None and (data or command):
+            self.recorder.write(command, data)
+        if self.history_buffer is not None and (data or command):
+            self.history_buffer.append(command, data)
+        if not data:
+            return
+        if self.metrics is not None:
+            self.metrics.count('bytes_received', len(data))
+        self.byte_stream.feed(data)
+        self.generation += 1
+        self._update_observation()
+
+    def get_cached(self, key, func):
+        """
+        Returns func() computed for the current screen generation, reusing
+        the previous result if nothing has been fed since. Values are shared,
+        treat them as read only.
+        """
+        entry = self._frame_cache.get(key)
+        if entry is not None and entry[0] == self.generation:
+            self.cache_hits[key] += 1
+            return entry[1]
+        self.cache_misses[key] += 1
+        value = func()
+        self._frame_cache[key] = (self.generation, value)
+        return value
+
+    def invalidate(self):
+        """
+        Forget everything derived from the current screen, so the next
+        reads compute it again.
+        """
+        self.generation += 1
+        self._status_dirty = True
+
+    def _update_observation(self):
+        """
+        Recompute npdata and rgb for the map rows pyte marked dirty since the
+        last update and record which cells changed in changed_cells.
+        """
+        rows = set()
+        for line in self.screen.dirty:
+            if line >= self.rows - 2:
+                self._status_dirty = True
+            row = line - self.map_skiplines
+            if 0 <= row < self.map_x_y.x:
+                rows.add(row)
+        self.screen.dirty.clear()
+
+        # The old cursor highlight has to be painted over as well
+        if self._cursor_cell is not None:
+            rows.add(self._cursor_cell[0])
+
+        if rows:
+            rows = sorted(rows)
+            glyph_rows = [self.screen.glyph_map[row] for row in rows]
+            npdata = self.nhdata.collapse_glyphs(glyph_rows)
+            self.changed_cells[rows] |= npdata != self.npdata[rows]
+            self.npdata[rows] = npdata
+            self.rgb[rows] = self._glyphs_to_rgb(npdata)
+
+        # cursor axis are flipped v.s. image, and the map starts a line down
+        self._cursor_cell = None
+        row = self.screen.cursor.y - self.map_skiplines
+        if 0 <= row < self.map_x_y.x and self.screen.cursor.x < self.map_x_y.y:
+            self._cursor_cell = (row, self.screen.cursor.x)
+            self.rgb[self._cursor_cell] = self._highlight # highlight player.
+
+    def _set_rgb_table(self, dtype):
+        self._rgb_table = self.nhdata.rgb_table(dtype)
+        dtype = np.dtype(dtype)
+        self._highlight = np.iinfo(dtype).max if dtype.kind in 'iu' else 1
+
+    def set_observation_dtype(self, dtype):
+        """
+        Switch the rgb observation to another dtype, e.g. np.uint8 or
+        np.float16 for an observation a fraction of the float64 size.
+        """
+        if np.dtype(dtype) == self.rgb.dtype:
+            return
+        self.observation_dtype = dtype
+        self._set_rgb_table(dtype)
+        self.rgb = self._glyphs_to_rgb(self.npdata)
+        if self._cursor_cell is not None:
+            self.rgb[self._cursor_cell] = self._highlight
+        self.generation += 1
+
+    def get_changed_cells(self, clear=True):
+        """
+        Returns the (row, col) map cells whose glyph changed since the last
+        call, optionally leaving the changes in place for other readers.
+        """
+        cells = np.argwhere(self.changed_cells)
+        if clear:
+            self.changed_cells[:] = False
+        return cells
 
     def buffer_to_npdata(self):
-        self.npdata = np.vectorize(self.nhdata.collapse_glyph)(self.screen.glyph_map)
+        """
+        Returns the collapsed glyphs of the map, updated as data arrives.
+        This is the live array, copy it before holding on to it.
+        """
 
 #        skiplines = 1
 #        self.npdata *= 0
@@ -253,55 +565,52 @@ class NhInterface:
         return self.npdata
 
     def buffer_to_rgb(self):
-        npdata = self.buffer_to_npdata()
-        min_m, max_m = self.nhdata.monsters.minkey, self.nhdata.monsters.maxkey
-        min_o, max_o = self.nhdata.objects.minkey, self.nhdata.objects.maxkey
-        min_r, max_r = self.nhdata.rooms.minkey, self.nhdata.rooms.maxkey
-        r,b,g = npdata.copy().astype(np.float32), npdata.copy().astype(np.float32), npdata.copy().astype(np.float32)
-
-        r = self._normalize_layer(r, min_m, max_m) # creatures
-        b = self._normalize_layer(b, min_r, max_r) # room
-        g = self._normalize_layer(g, min_o, max_o) # object
-
-        rgb = np.zeros((r.shape + (3,)))
-        rgb[:,:,0] = r
-        rgb[:,:,1] = b
-        rgb[:,:,2] = g
-
-        # cursor axis are flipped v.s. image or I made more x,y mistakes
-        if self.screen.cursor.y < self.map_x_y.x and self.screen.cursor.x < self.map_x_y.y:
-            rgb[self.screen.cursor.y, self.screen.cursor.x, :] = 1 # highlight player.
-
-        return rgb
+        return self.get_cached('rgb', self.rgb.copy)
 
-    def _normalize_layer(self, data, min_val, max_val, skew=0.2):
-        #backup = data.copy()
-        data[data < min_val] = min_val
-        data[data > max_val] = min_val
-        data += -(min_val)
-        data /= max_val
-
-        if data.min() < 0:
-            raise ValueError("dang")
-
-        #skew data away from 0
-        data *= 1.0 - skew
-        data[data>0] += skew
-
-        return data
+    def buffer_to_features(self, out=None):
+        """
+        (F + 1, rows, cols) float32 feature planes of the map, one
+        NhData.feature_table column per plane followed by a player plane.
+        Written into out if given, which bypasses the cache.
+        """
+        if out is not None:
+            return self._glyphs_to_features(out)
+        return self.get_cached('features', self._glyphs_to_features)
+
+    def _glyphs_to_features(self, out=None):
+        if self._feature_planes is None:
+            table = self.nhdata.feature_table()
+            # One extra all zero feature that becomes the player plane
+            planes = np.zeros((table.shape[1] + 1, table.shape[0]), dtype=np.float32)
+            planes[:-1] = table.T
+            type(self)._feature_planes = planes # nhdata is shared, so are these
+        features = np.take(self._feature_planes, self.npdata, axis=1, out=out)
+        if self._cursor_cell is not None:
+            features[(-1,) + self._cursor_cell] = 1
+        return features
+
+    def _glyphs_to_rgb(self, npdata, out=None):
+        """
+        Creatures, room and objects channels of collapsed glyphs, one row
+        of NhData.rgb_table per glyph.
+        """
+        return np.take(self._rgb_table, npdata, axis=0, out=out)
 
     def _connect_with_retry(self):
+        # Imported here so AsyncNhInterface works where telnetlib is gone
+        import telnetlib
         retries = 0
         limit = 3
         while retries < limit:
             try:
                 self.logger.debug("Connection to {} retry {}".format(self.game_address, retries))
-                self.tn = telnetlib.Telnet(self.game_address)
-                data = self.tn.read_until(b'\x1b[19;3H=> ', 2)
-                self.byte_stream.feed(data)
+                self.tn = telnetlib.Telnet(self.game_address, self.game_port)
+                data = self._read_response(b'\x1b[19;3H=> ', 2)
+                self._feed(data)
                 return
             except ConnectionRefusedError:
                 retries += 1
+                self.count('connect_retries')
                 time.sleep(1 * retries )
         self.logger.warning("{} connection refused".format(self.username))
         raise ConnectionRefusedError
@@ -313,29 +622,51 @@ class NhInterface:
             self.start_session()
         # TODO: is this ever not b''?
         data = self.tn.read_very_eager()
-        self.byte_stream.feed(data)
-        page = " ".join(self.screen.display)
-        self.is_special_prompt = False
-        for s in self._states:
-            setattr(self, "is_" + s, False)
-            for string in self._states[s]:
-                if string in page:
-                    setattr(self, "is_" + s, True)
-                    for sp in self._special_prompts:
-                        if sp in s:
-                            self.is_special_prompt = True
-
-        self.is_blank = True
-        for c in page:
-            if c != ' ':
-                self.is_blank = False
-                break
+        self._feed(data)
+        self._parse_states()
+
+    def _parse_states(self):
+        """
+        Sets states from the current screen with the compiled state table.
+        Repeated reads of an unchanged screen reuse the last result.
+        Transport agnostic so other interfaces can share it.
+        """
+        self._update_states()
+
         if self.is_game_screen and self.screen.cursor.y == 0 and not self.is_special_prompt:
             raise ValueError("Unexpected prompt {}".format(self.screen.display[0]))
 
 
 
 
+    def _update_states(self):
+        self.states = self.get_cached('states', lambda: StateFlag(
+                self._detect_states(" ".join(self.get_display()))))
+
+    def _detect_states(self, page):
+        states = 0
+        for string, flag in self._state_table:
+            if string in page:
+                states |= flag
+        if states & self._special_mask:
+            states |= StateFlag.SPECIAL_PROMPT
+        if not page.strip(' '):
+            states |= StateFlag.BLANK
+        return states
+
+    @classmethod
+    def _compile_states(cls):
+        """
+        Flatten _states into (substring, flag) pairs and work out which
+        flags count as special prompts, done once at import.
+        """
+        cls._state_table = [(string, int(StateFlag[s.upper()]))
+                            for s in cls._states for string in cls._states[s]]
+        cls._special_mask = 0
+        for s in cls._states:
+            if any(sp in s for sp in cls._special_prompts):
+                cls._special_mask |= int(StateFlag[s.upper()])
+
     def _get_states(self):
         states = {}
         for s in self._states:
@@ -358,6 +689,7 @@ class NhInterface:
 
 
     def imshow_map(self):
+        import matplotlib.pyplot as plt
         img = self.render_glyphs()
         fig, ax = plt.subplots(figsize=(12,4))
         ax.axis('off')
@@ -373,8 +705,21 @@ class NhInterface:
                 visible.append([mob, npdata[mob[0],mob[1]]])
         return visible
 
+    def get_display(self):
+        return self.get_cached('display', lambda: self.screen.display)
+
     def get_status(self):
-        return self.nhdata.get_status(self.screen.display)
+        """
+        Returns the NhData.STATUS_DTYPE record of the bottom lines, only
+        parsed again after one of those lines changed.
+        """
+        if self._status_dirty:
+            self.cache_misses['status'] += 1
+            self._status = self.nhdata.get_status(self.get_display())
+            self._status_dirty = False
+        else:
+            self.cache_hits['status'] += 1
+        return self._status
 
     def send_command(self, action_num):
         command = self.nhdata.COMMANDS[action_num]
@@ -386,10 +731,111 @@ class NhInterface:
 
 
 
+StateFlag = enum.IntFlag('StateFlag', [s.upper() for s in NhInterface._states]
+                                      + ['BLANK', 'SPECIAL_PROMPT'])
+
+for _flag in StateFlag:
+    setattr(NhInterface, 'is_' + _flag.name.lower(),
+            property(lambda self, flag=_flag: bool(self.states & flag)))
+NhInterface._compile_states()
+
+
 if __name__ == '__main__':
     sampledata1 = b'\x1b[2;0z\x1b[2;1z\x1b[H\x1b[K\x1b[2;3z\x1b[2J\x1b[H\x1b[2;1z\x1b[2;3z\x1b[4;69H\x1b[0;832z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;833z-\x1b[1z\x1b[0m\x1b[5;69H\x1b[0;830z|\x1b[1z\x1b[0;848z\x1b[0m\x1b[1m\x1b[30m.\x1b[1z\x1b[0;16z\x1b[0m\x1b[1m\x1b[37m\x1b[7md\x1b[0m\x1b[0m\x1b[1z\x1b[0;848z\x1b[1m\x1b[30m.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;830z\x1b[0m|\x1b[1z\x1b[0m\x1b[6;69H\x1b[0;830z|\x1b[1z\x1b[0;45z\x1b[0m\x1b[1m\x1b[37mh\x1b[1z\x1b[0;848z\x1b[0m\x1b[1m\x1b[30m.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;830z\x1b[0m|\x1b[1z\x1b[0m\x1b[7;69H\x1b[0;844z\x1b[1m\x1b[31m+\x1b[1z\x1b[0;848z\x1b[0m\x1b[1m\x1b[30m.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;830z\x1b[0m|\x1b[1z\x1b[0m\x1b[8;69H\x1b[0;830z|\x1b[1z\x1b[0;848z\x1b[0m\x1b[1m\x1b[30m.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;830z\x1b[0m|\x1b[1z\x1b[0m\x1b[9;70H\x1b[0;848z\x1b[1m\x1b[30m.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;830z\x1b[0m|\x1b[1z\x1b[0m\x1b[10;69H\x1b[0;830z|\x1b[1z\x1b[0;848z\x1b[0m\x1b[1m\x1b[30m.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;848z.\x1b[1z\x1b[0;830z\x1b[0m|\x1b[1z\x1b[0m\x1b[11;69H\x1b[0;834z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;831z-\x1b[1z\x1b[0;835z-\x1b[1z\x1b[0m\x1b[6;70H\x1b[2;2z\x1b[23;1H\x1b[K[\x1b[7m\x08\x1b[1m\x1b[32m\x1b[CAa the Stripling\x1b[0m\x1b[0m\x1b[0m\r\x1b[23;18H]          St:18/02 Dx:14 Co:16 In:8 Wi:9 Ch:8  Lawful S:0\r\x1b[24;1H'
     sampledata2 = b'Dlvl:1  $:0  HP:\x1b[K\r\x1b[1m\x1b[32m\x1b[24;17H18(18)\x1b[0m\r\x1b[24;23H Pw:\r\x1b[1m\x1b[32m\x1b[24;27H1(1)\x1b[0m\r\x1b[24;31H AC:6  Xp:1/0 T:1\x1b[2;1z\x1b[HVelkommen aa, the dwarven Valkyrie, welcome back to NetHack!\x1b[K\x1b[2;3z\x1b[6;70H\x1b[3z'
     sampledata = sampledata1 + sampledata2
+    from pyte import Screen, ByteStream
+    import matplotlib.pyplot as plt
+#%%
+    def benchmark_collapse(reps=1000):
+        """
+        Frames per second of the glyph collapse on the SAMPLE_DATA streams,
+        old per-cell np.vectorize against the lookup table gather.
+        """
+        screen = Screen(NhInterface.cols, NhInterface.rows)
+        stream = ByteStream()
+        stream.attach(screen)
+        for data in NhData.SAMPLE_DATA:
+            stream.feed(data)
+        nhdata = NhInterface.nhdata
+        out = np.zeros(NhInterface.map_x_y, dtype=np.int32)
+
+        start = time.monotonic()
+        for _ in range(reps):
+            old = np.vectorize(nhdata.collapse_glyph)(screen.glyph_map)
+        vectorize_fps = reps / (time.monotonic() - start)
+
+        start = time.monotonic()
+        for _ in range(reps):
+            nhdata.collapse_glyphs(screen.glyph_map, out=out)
+        gather_fps = reps / (time.monotonic() - start)
+
+        assert np.array_equal(old, out)
+        print("np.vectorize: {:.0f} fps, lookup table: {:.0f} fps ({:.1f}x)".format(
+                vectorize_fps, gather_fps, gather_fps / vectorize_fps))
+
+    benchmark_collapse()
+
+#%%
+    def benchmark_states(reps=10000):
+        """
+        The old setattr per state _read_states against the compiled table.
+        """
+        def old_parse_states(nhi, page):
+            found = {'special_prompt': False}
+            for s in nhi._states:
+                found[s] = False
+                for string in nhi._states[s]:
+                    if string in page:
+                        found[s] = True
+                        for sp in nhi._special_prompts:
+                            if sp in s:
+                                found['special_prompt'] = True
+            found['blank'] = True
+            for c in page:
+                if c != ' ':
+                    found['blank'] = False
+                    break
+            return found
+
+        nhi = NhInterface.__new__(NhInterface)
+        nhi.username, nhi.tn = 'bench', None
+        nhi._init_screen()
+        for data in NhData.SAMPLE_DATA:
+            nhi._feed(data)
+        page = " ".join(nhi.screen.display)
+
+        start = time.monotonic()
+        for _ in range(reps):
+            old = old_parse_states(nhi, page)
+        old_rate = reps / (time.monotonic() - start)
+
+        start = time.monotonic()
+        for _ in range(reps):
+            nhi._detect_states(page)
+        new_rate = reps / (time.monotonic() - start)
+
+        nhi._parse_states()
+        for s in old:
+            assert old[s] == getattr(nhi, 'is_' + s)
+        print("detect on a new screen, setattr loop: {:.0f}/s, compiled table: {:.0f}/s ({:.1f}x)".format(
+                old_rate, new_rate, new_rate / old_rate))
+
+        # _read_states mostly sees an unchanged screen, e.g. in _clear_more
+        start = time.monotonic()
+        for _ in range(reps // 10):
+            old_parse_states(nhi, " ".join(nhi.screen.display))
+        old_rate = (reps // 10) / (time.monotonic() - start)
+
+        start = time.monotonic()
+        for _ in range(reps):
+            nhi._parse_states()
+        new_rate = reps / (time.monotonic() - start)
+        print("unchanged screen, setattr loop: {:.0f}/s, compiled table: {:.0f}/s ({:.1f}x)".format(
+                old_rate, new_rate, new_rate / old_rate))
+
+    benchmark_states()
+
 #%%
     def smoke_test():
         nhi = NhInterface()
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:31:08 2026
+
+@author: dandrews
+
+A purpose built terminal for the NetHack tty with vt_tiledata. Instead of
+a full pyte Screen of character objects it only keeps what the interface
+needs, written straight into NumPy arrays:
+    chars   (lines, columns) uint8 character grid
+    glyphs  (lines, columns) uint16 glyph grid from the \x1b[0;Nz escapes
+    cursor, the window selected by \x1b[2;Nz and the \x1b[3z input waits
+It is both the byte stream and the screen, see NhInterface._init_screen.
+"""
+import numpy as np
+import re
+
+
+class Cursor:
+    __slots__ = ['x', 'y']
+    def __init__(self, x=0, y=0):
+        self.x = x
+        self.y = y
+
+
+class NhTerminal:
+    """
+    Screen and byte stream in one. feed() takes raw telnet bytes and
+    updates chars, glyphs, cursor and dirty lines.
+    """
+    DEFAULT_GLYPH = 829 # solid rock, anything drawn without a glyph
+    TAB_WIDTH = 8
+    MAP_LINES = slice(1, 22) # map rows of glyph_map, below the message line
+
+    # One token per printable run, control character or escape sequence.
+    # A whole map cell, \x1b[0;Nz + colours + character + \x1b[1z, is the
+    # most common sequence by far so it gets a token of its own.
+    _token = re.compile(
+        rb'\x1b\[0;(?P<tile>[0-9]+)z(?:\x1b\[[0-9;]*m)*'
+        rb'(?P<tilechar>[^\x00-\x1f\x1b\x7f])(?:\x1b\[[0-9;]*m)*\x1b\[1z'
+        rb'|(?P<text>[^\x00-\x1f\x1b\x7f]+)'
+        rb'|\x1b\[(?P<private>[?>]?)(?P<params>[0-9;]*)(?P<csi>[@A-Za-z`])'
+        rb'|\x1b(?P<charset>[()*+].)'
+        rb'|\x1b(?P<esc>[^\[()*+])'
+        rb'|(?P<ctrl>[\x00-\x1f\x7f])')
+    # An escape sequence cut off at the end of a packet
+    _partial = re.compile(rb'\x1b(\[[?>]?[0-9;]*|[()*+])?\Z')
+
+    def __init__(self, columns=80, lines=24):
+        self.columns = columns
+        self.lines = lines
+        self.chars = np.empty((lines, columns), dtype=np.uint8)
+        self.glyphs = np.empty((lines, columns), dtype=np.uint16)
+        self.cursor = Cursor()
+        self.dirty = set()
+        self.reset()
+
+    def reset(self):
+        self.chars.fill(ord(' '))
+        self.glyphs.fill(self.DEFAULT_GLYPH)
+        self.cursor.x = self.cursor.y = 0
+        self._saved_cursor = (0, 0)
+        self._pending = b''
+        self._glyph = None
+        self._display = None
+        self.window = 0
+        self.input_waits = 0
+        self.dirty.update(range(self.lines))
+
+    @property
+    def glyph_map(self):
+        return self.glyphs[self.MAP_LINES]
+
+    @property
+    def display(self):
+        if self._display is None:
+            self._display = [line.tobytes().decode('latin-1') for line in self.chars]
+        return self._display
+
+    def attach(self, screen):
+        """
+        Compatibility with pyte.ByteStream, the terminal is its own screen.
+        """
+        if screen is not self:
+            raise ValueError("NhTerminal can only be attached to itself")
+
+    def feed(self, data):
+        if self._pending:
+            data = self._pending + data
+            self._pending = b''
+        partial = self._partial.search(data)
+        if partial:
+            self._pending = data[partial.start():]
+            data = data[:partial.start()]
+        if not data:
+            return
+        self._display = None
+
+        for m in self._token.finditer(data):
+            kind = m.lastgroup
+            if kind == 'tilechar':
+                self._draw_tile(int(m.group('tile')), m.group('tilechar')[0])
+            elif kind == 'text':
+                self._draw(m.group('text'))
+            elif kind == 'csi':
+                self._csi(m.group('csi'), m.group('params'), m.group('private'))
+            elif kind == 'ctrl':
+                self._control(m.group('ctrl'))
+            elif kind == 'esc':
+                self._escape(m.group('esc'))
+            # charset designations are ignored
+
+    def _draw_tile(self, glyph, char):
+        cursor = self.cursor
+        if cursor.x >= self.columns:
+            cursor.x = 0
+            self._linefeed()
+        y = cursor.y
+        self.chars[y, cursor.x] = char
+        self.glyphs[y, cursor.x] = glyph
+        self.dirty.add(y)
+        cursor.x += 1
+
+    def _draw(self, text):
+        glyph = self.DEFAULT_GLYPH if self._glyph is None else self._glyph
+        cursor = self.cursor
+        while text:
+            if cursor.x >= self.columns:
+                cursor.x = 0
+                self._linefeed()
+            n = min(len(text), self.columns - cursor.x)
+            y, x = cursor.y, cursor.x
+            self.chars[y, x:x + n] = np.frombuffer(text, dtype=np.uint8, count=n)
+            self.glyphs[y, x:x + n] = glyph
+            self.dirty.add(y)
+            cursor.x += n
+            text = text[n:]
+
+    def _control(self, c):
+        cursor = self.cursor
+        if c == b'\r':
+            cursor.x = 0
+        elif c in b'\n\x0b\x0c':
+            self._linefeed()
+        elif c == b'\x08':
+            cursor.x = max(min(cursor.x, self.columns - 1) - 1, 0)
+        elif c == b'\t':
+            cursor.x = min((cursor.x // self.TAB_WIDTH + 1) * self.TAB_WIDTH,
+                           self.columns - 1)
+        # bell, shift in/out and the rest are ignored
+
+    def _escape(self, c):
+        cursor = self.cursor
+        if c == b'7':
+            self._saved_cursor = (cursor.x, cursor.y)
+        elif c == b'8':
+            cursor.x, cursor.y = self._saved_cursor
+        elif c == b'D':
+            self._linefeed()
+        elif c == b'E':
+            cursor.x = 0
+            self._linefeed()
+        elif c == b'M':
+            if cursor.y == 0:
+                self._scroll(-1)
+            else:
+                cursor.y -= 1
+        elif c == b'c':
+            self.reset()
+        # keypad modes and anything else are ignored
+
+    def _linefeed(self):
+        if self.cursor.y == self.lines - 1:
+            self._scroll(1)
+        else:
+            self.cursor.y += 1
+
+    def _scroll(self, n):
+        self.chars[:] = np.roll(self.chars, -n, axis=0)
+        self.glyphs[:] = np.roll(self.glyphs, -n, axis=0)
+        blank = slice(self.lines - n, None) if n > 0 else slice(0, -n)
+        self.chars[blank] = ord(' ')
+        self.glyphs[blank] = self.DEFAULT_GLYPH
+        self.dirty.update(range(self.lines))
+
+    def _erase(self, y, start, stop):
+        self.chars[y, start:stop] = ord(' ')
+        self.glyphs[y, start:stop] = self.DEFAULT_GLYPH
+        self.dirty.add(y)
+
+    def _csi(self, command, params, private):
+        if private:
+            return # modes like ?1049h do not change the grid
+        args = [int(p) if p else 0 for p in params.split(b';')] if params else []
+        arg = args[0] if args else 0
+        count = arg or 1
+        cursor = self.cursor
+
+        if command == b'z':
+            if arg == 0 and len(args) > 1:
+                self._glyph = args[1]
+            elif arg == 1:
+                self._glyph = None
+            elif arg == 2 and len(args) > 1:
+                self.window = args[1]
+            elif arg == 3:
+                self.input_waits += 1
+        elif command in b'Hf':
+            row = args[0] if args and args[0] else 1
+            col = args[1] if len(args) > 1 and args[1] else 1
+            cursor.y = min(row, self.lines) - 1
+            cursor.x = min(col, self.columns) - 1
+        elif command == b'd':
+            cursor.y = min(count, self.lines) - 1
+        elif command in b'G`':
+            cursor.x = min(count, self.columns) - 1
+        elif command == b'A':
+            cursor.y = max(cursor.y - count, 0)
+        elif command in b'Be':
+            cursor.y = min(cursor.y + count, self.lines - 1)
+        elif command in b'Ca':
+            cursor.x = min(cursor.x + count, self.columns - 1)
+        elif command == b'D':
+            cursor.x = max(min(cursor.x, self.columns - 1) - count, 0)
+        elif command == b'K':
+            if arg == 0:
+                self._erase(cursor.y, cursor.x, self.columns)
+            elif arg == 1:
+                self._erase(cursor.y, 0, cursor.x + 1)
+            elif arg == 2:
+                self._erase(cursor.y, 0, self.columns)
+        elif command == b'J':
+            if arg == 0:
+                self._erase(cursor.y, cursor.x, self.columns)
+                lines = range(cursor.y + 1, self.lines)
+            elif arg == 1:
+                self._erase(cursor.y, 0, cursor.x + 1)
+                lines = range(0, cursor.y)
+            else:
+                lines = range(self.lines)
+            for y in lines:
+                self._erase(y, 0, self.columns)
+        elif command == b'X':
+            self._erase(cursor.y, cursor.x, cursor.x + count)
+        elif command in b'@P':
+            y, x = cursor.y, cursor.x
+            for grid, blank in ((self.chars, ord(' ')), (self.glyphs, self.DEFAULT_GLYPH)):
+                line = grid[y, x:].copy()
+                if command == b'@':
+                    grid[y, x + count:] = line[:max(len(line) - count, 0)]
+                    grid[y, x:x + count] = blank
+                else:
+                    grid[y, x:self.columns - count] = line[count:]
+                    grid[y, max(self.columns - count, x):] = blank
+            self.dirty.add(y)
+        elif command in b'LM':
+            y = cursor.y
+            for grid, blank in ((self.chars, ord(' ')), (self.glyphs, self.DEFAULT_GLYPH)):
+                region = grid[y:].copy()
+                if command == b'L':
+                    grid[y + count:] = region[:max(len(region) - count, 0)]
+                    grid[y:y + count] = blank
+                else:
+                    grid[y:self.lines - count] = region[count:]
+                    grid[max(self.lines - count, y):] = blank
+            self.dirty.update(range(y, self.lines))
+        # SGR colours, scroll margins and reports are ignored
+
+
+if __name__ == '__main__':
+    from nhdata import NhData
+    from pyte import Screen, ByteStream
+    import time
+
+#%%
+    def benchmark_parser(reps=200):
+        """
+        MB/s through pyte and through NhTerminal on the SAMPLE_DATA frames.
+        """
+        frames = NhData.SAMPLE_DATA
+        megabytes = reps * sum(len(f) for f in frames) / 1e6
+
+        start = time.monotonic()
+        for _ in range(reps):
+            screen = Screen(80, 24)
+            stream = ByteStream()
+            stream.attach(screen)
+            for f in frames:
+                stream.feed(f)
+        pyte_rate = megabytes / (time.monotonic() - start)
+
+        start = time.monotonic()
+        for _ in range(reps):
+            terminal = NhTerminal(80, 24)
+            for f in frames:
+                terminal.feed(f)
+        native_rate = megabytes / (time.monotonic() - start)
+
+        assert screen.display == terminal.display
+        assert (screen.cursor.x, screen.cursor.y) == (terminal.cursor.x, terminal.cursor.y)
+        print("pyte: {:.2f} MB/s, NhTerminal: {:.2f} MB/s ({:.1f}x)".format(
+                pyte_rate, native_rate, native_rate / pyte_rate))
+
+    benchmark_parser()
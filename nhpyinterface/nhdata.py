@@ -5,8 +5,9 @@ Created on Wed Jan 10 13:50:11 2018
 @author: dandrews based on lmj.nethack
 """
 import collections
-import pickle
 import re
+import numpy as np
+from glyph_db import load_glyph_db, read_glyph_pickle
 from monsters import Monsters
 from objects import Objects
 from rooms import RoomTiles
@@ -80,6 +81,28 @@ class NhData():
         50:Command('WIPE', '#wipe', 10)
         }
 
+    # Multi-key sequences sent with NhInterface.send_macro in one write.
+    # Keys: every key the game reads, prompt: what ends the response when
+    # it is not another input wait, e.g. the dgamelaunch menu after saving.
+    Macro = collections.namedtuple('macro', 'name keys prompt')
+
+    MACROS = {
+        'YES': Macro('YES', 'y\n', b'\x1b[3z'),
+        'NO': Macro('NO', 'n\n', b'\x1b[3z'),
+        'SAVE': Macro('SAVE', 'Sy\n', b'=>'),
+
+        # Rush in a direction until something interesting, see COMMANDS 1-9
+        'EXPLORE_SW': Macro('EXPLORE_SW', 'G1', b'\x1b[3z'),
+        'EXPLORE_S': Macro('EXPLORE_S', 'G2', b'\x1b[3z'),
+        'EXPLORE_SE': Macro('EXPLORE_SE', 'G3', b'\x1b[3z'),
+        'EXPLORE_W': Macro('EXPLORE_W', 'G4', b'\x1b[3z'),
+        'EXPLORE_SEARCH': Macro('EXPLORE_SEARCH', 'G5', b'\x1b[3z'),
+        'EXPLORE_E': Macro('EXPLORE_E', 'G6', b'\x1b[3z'),
+        'EXPLORE_NW': Macro('EXPLORE_NW', 'G7', b'\x1b[3z'),
+        'EXPLORE_N': Macro('EXPLORE_N', 'G8', b'\x1b[3z'),
+        'EXPLORE_NE': Macro('EXPLORE_NE', 'G9', b'\x1b[3z'),
+        }
+
     #Sample telnet data for testing
     SAMPLE_DATA = [b' \x1b[H\x1b[2J\x1b[2d ## \x1b(B\x1b[0;1m\x1b[33m\x1b[40mnethack.alt.org - http://nethack.alt.org/\x1b[6;2H\x1b[39;49m\x1b(B\x1b[mPlease enter your username. (blank entry aborts)\r\x1b[8d =>',
  b' aa\x1b[H\x1b[2J\x1b[2d ## \x1b(B\x1b[0;1m\x1b[33m\x1b[40mnethack.alt.org - http://nethack.alt.org/\x1b[6;2H\x1b[39;49m\x1b(B\x1b[mPlease enter your password.\r\x1b[8d =>',
@@ -90,6 +113,32 @@ class NhData():
     ABILITY_SCORES = ['st', 'dx', 'co', 'in', 'wi', 'ch']
     PLAYER_SCORES = ['dlvl', 'zorkmids', 'hp', 'pw', 'ac', 'xp', 't']
 
+    # Fixed layout of get_status, fields not found on screen keep these values
+    STATUS_DTYPE = np.dtype([(name, np.int32) for name in [
+            'hp_max', 'ac', 'ch', 'co', 'dlvl', 'dx', 'hp', 'in', 'pw', 'st',
+            'st2', 't', 'wi', 'xp', 'zorkmids', 'score']])
+    _status_defaults = np.array((0, 0, 0, 0, -1, 0, 0, 0, 0, 0, 0, -1, 0, -1, -1, 0),
+                                dtype=STATUS_DTYPE)
+
+    _char_stats = re.compile(
+        r'St:(?P<st>\d+)'
+        r'.*?Dx:(?P<dx>\d+)'
+        r'.*?Co:(?P<co>\d+)'
+        r'.*?In:(?P<in>\d+)'
+        r'.*?Wi:(?P<wi>\d+)'
+        r'.*?Ch:(?P<ch>\d+)'
+        r'.*?S:(?P<score>\d+)')
+
+    _dungeon_stats = re.compile(
+        r'Dlvl:(?P<dlvl>\d+)'
+        r'.*?\$:(?P<zorkmids>\d+)'
+        r'.*?HP:(?P<hp>\d+)'
+        r'.*?\((?P<hp_max>\d+)\)'
+        r'.*?Pw:(?P<pw>\d+)\(\d+\)'
+        r'.*?AC:(?P<ac>\d+)'
+        r'.*?Xp:(?P<xp>\d+)(?:[/\d]+)'
+        r'.*?T:(?P<t>\d+)')
+
 
     #####
     # End constants, begin 'regular' class stuff.
@@ -98,68 +147,58 @@ class NhData():
     glyph_pickle_file = "glyphs.pkl"
     local_dir = os.path.abspath(os.path.dirname(__file__))
     glyph_pickle_file = os.path.join(local_dir, glyph_pickle_file)
+    glyph_db_file = os.path.join(local_dir, "glyphs.db")
+    # Load the precompiled tables of glyph_db instead of the pickle
+    use_glyph_db = True
+    _glyphs = None
 
 
     def __init__(self):
-        with open(self.glyph_pickle_file, 'rb') as glyph_file:
-            glyphs = pickle.load(glyph_file)
-        self.glyphs = glyphs
-        self.monsters = Monsters(glyphs)
-        self.objects = Objects(glyphs)
-        self.rooms = RoomTiles(glyphs)
+        if self.use_glyph_db:
+            self.monsters, self.objects, self.rooms = load_glyph_db(
+                    self.glyph_pickle_file, self.glyph_db_file)
+        else:
+            glyphs = self.glyphs
+            self.monsters = Monsters(glyphs)
+            self.objects = Objects(glyphs)
+            self.rooms = RoomTiles(glyphs)
+        self.num_glyphs = max(len(self.rooms.glyph_map), self.rooms.maxkey + 1)
+        self._rgb_tables = {}
+        self._feature_table = None
 
 
+    @property
+    def glyphs(self):
+        """
+        The raw glyph dict of glyphs.pkl, only read when asked for.
+        """
+        if self._glyphs is None:
+            self._glyphs = read_glyph_pickle(self.glyph_pickle_file)
+        return self._glyphs
+
     def get_status(self, lines):
-        return_dict = {
-                     'hp_max':0,
-                     'ac': 0,
-                     'ch': 0,
-                     'co': 0,
-                     'dlvl': -1,
-                     'dx': 0,
-                     'hp': 0,
-                     'in': 0,
-                     'pw': 0,
-                     'st': 0,
-                     'st2': 0,
-                     't': -1,
-                     'wi': 0,
-                     'xp': -1,
-                     'zorkmids': -1,
-                     'score': 0}
-
-        char_stats = re.search(
-        r'St:(?P<st>\d+)'
-        r'.*Dx:(?P<dx>\d+)'
-        r'.*Co:(?P<co>\d+)'
-        r'.*In:(?P<in>\d+)'
-        r'.*Wi:(?P<wi>\d+)'
-        r'.*Ch:(?P<ch>\d+)'
-        r'.*S:(?P<score>\d+)', lines[-2])
+        """
+        Parse the two status lines into a STATUS_DTYPE record, fields are
+        read like a dict, e.g. status['t'].
+        """
+        status = self._status_defaults.copy()
+
+        char_stats = self._char_stats.search(lines[-2])
         if char_stats:
-            return_dict = {**return_dict, **char_stats.groupdict()}
-
-        dungeon_stats = re.search(
-            r'Dlvl:(?P<dlvl>\d+)'
-            r'.*\$:(?P<zorkmids>\d+)'
-            r'.*HP:(?P<hp>\d+)'
-            r'.*\((?P<hp_max>\d+)\)'
-            r'.*Pw:(?P<pw>\d+)\(\d+\)'
-            r'.*AC:(?P<ac>\d+)'
-            r'.*Xp:(?P<xp>\d+)([/\d]+)'
-            r'.*T:(?P<t>\d+)'
-            , lines[-1])
+            for k, v in char_stats.groupdict().items():
+                status[k] = int(v)
 
+        dungeon_stats = self._dungeon_stats.search(lines[-1])
         if dungeon_stats:
-            return_dict = {**return_dict, **dungeon_stats.groupdict()}
-        # Convert to ints
-        for k in return_dict:
-            return_dict[k] = int(return_dict[k])
+            for k, v in dungeon_stats.groupdict().items():
+                status[k] = int(v)
 
         # In Nethack negative AC is better
-        if 'ac' in return_dict:
-            return_dict['ac'] = -1 * return_dict['ac']
-        return return_dict
+        status['ac'] *= -1
+        return status[()]
+
+    def get_explore_macro(self, action):
+        return self.MACROS['EXPLORE_' + self.COMMANDS[action].name]
 
     def get_commands(self, max_rating):
         return [i for i in self.COMMANDS if self.COMMANDS[i].rating<=max_rating]
@@ -167,6 +206,73 @@ class NhData():
     def collapse_glyph(self, glyph):
         return self.rooms.collapse_glyph(glyph)
 
+    def collapse_glyphs(self, glyphs, out=None):
+        """
+        Collapse a whole array of glyphs at once with the rooms lookup table.
+        Pass out to fill a preallocated int32 array instead of allocating.
+        """
+        return np.take(self.rooms.glyph_map, glyphs, out=out)
+
+    def rgb_table(self, dtype=np.float64, skew=0.2):
+        """
+        (num_glyphs, 3) lookup table from a collapsed glyph to its
+        (monster, room, object) channels, see NhInterface._glyphs_to_rgb.
+        Each channel is the glyph's position in that range scaled to
+        [skew, 1], or 0 outside it. Integer dtypes are scaled to their
+        full range, e.g. 0-255 for np.uint8.
+        """
+        dtype = np.dtype(dtype)
+        key = (dtype, skew)
+        if key not in self._rgb_tables:
+            glyphs = np.arange(self.num_glyphs, dtype=np.float32)
+            ranges = [(self.monsters.minkey, self.monsters.maxkey),
+                      (self.rooms.minkey, self.rooms.maxkey),
+                      (self.objects.minkey, self.objects.maxkey)]
+            table = np.stack([self._normalize_layer(glyphs.copy(), min_val, max_val, skew)
+                              for min_val, max_val in ranges], axis=-1)
+            if dtype.kind in 'iu':
+                table = np.round(table * np.iinfo(dtype).max)
+            table = table.astype(dtype)
+            table.setflags(write=False)
+            self._rgb_tables[key] = table
+        return self._rgb_tables[key]
+
+    @property
+    def feature_names(self):
+        return self.monsters.feature_names + self.rooms.feature_names + \
+               self.objects.feature_names
+
+    def feature_table(self):
+        """
+        (num_glyphs, F) float32 table of everything known about each glyph,
+        the Monsters, RoomTiles and Objects features side by side, column
+        names in feature_names.
+        """
+        if self._feature_table is None:
+            table = np.concatenate([self.monsters.feature_table(self.num_glyphs),
+                                    self.rooms.feature_table(self.num_glyphs),
+                                    self.objects.feature_table(self.num_glyphs)],
+                                   axis=1)
+            table.setflags(write=False)
+            self._feature_table = table
+        return self._feature_table
+
+    @staticmethod
+    def _normalize_layer(data, min_val, max_val, skew=0.2):
+        data[data < min_val] = min_val
+        data[data > max_val] = min_val
+        data += -(min_val)
+        data /= max_val
+
+        if data.min() < 0:
+            raise ValueError("dang")
+
+        #skew data away from 0
+        data *= 1.0 - skew
+        data[data>0] += skew
+
+        return data
+
 if __name__ =='__main__':
     nhd = NhData()
     commands = nhd.get_commands(1)
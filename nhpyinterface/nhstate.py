@@ -6,17 +6,26 @@ Created on Tue Feb  6 17:39:19 2018
 """
 
 from nh_interface import NhInterface
-import pickle
+import os
 
 class NhState:
     """
     Class to understand stuff about the game, like inventory and items.
     """
     DEBUG_PRINT = False
-    progress_filename = "nh_progress.dat"
+    # Sessions are recorded to <progress_dir>/<username>.nhrec when the
+    # interface keeps history, see recorder.SessionReader to read them.
+    progress_dir = "nh_progress"
+    progress_compression = None
 
     def __init__(self, nhi : NhInterface):
         self.nhi = nhi
+        if self.nhi.SAVE_HISTORY and self.nhi.recorder is None:
+            self.nhi.start_recording(self.progress_filename, self.progress_compression)
+
+    @property
+    def progress_filename(self):
+        return os.path.join(self.progress_dir, self.nhi.username + ".nhrec")
 
     def check_game_state(self):
         """
@@ -35,16 +44,14 @@ class NhState:
                     message += ' {}: {}\n'.format(at, getattr(self.nhi, at))
                 raise ValueError("Unexpectedly looping\n" + message)
             if self.nhi.is_always_no_question:
-                self.nhi.send_string('n\n')
+                self.nhi.send_macro('NO')
             if self.nhi.is_killed or self.nhi.is_dgamelaunch:
                 done = True
             self._parse_screen()
             if self.nhi.is_always_yes_question:
-                self.nhi.send_string('y')
-                self.nhi.send_string('\n')
+                self.nhi.send_macro('YES')
             elif self.nhi.is_always_no_question:
-                self.nhi.send_string('n')
-                self.nhi.send_string('\n')
+                self.nhi.send_macro('NO')
             else:
                 self.nhi.send_string('\n')
             self._save_progress()
@@ -67,9 +74,8 @@ class NhState:
 
     def _save_progress(self):
         """
-        Saves the current history buffer. In the case of coming back to the
-        same session, old history will be lost.
-        TODO: Consider being able to continue sessions.
+        Makes sure the session recorded so far is on disk. Recordings are
+        appended to, coming back to the same session continues the file.
         """
-        with open(self.progress_filename, "wb") as outfile:
-            pickle.dump(self.nhi.data_history, outfile, protocol=pickle.HIGHEST_PROTOCOL)
\ No newline at end of file
+        if self.nhi.recorder is not None:
+            self.nhi.recorder.flush()
\ No newline at end of file
@@ -28,16 +28,49 @@ class Objects():
             }
 
     def __init__(self, glyphs):
-        self.glyphs = glyphs
-        gkeys = np.array([k for k in glyphs if glyphs[k]['type'] == 'object'], dtype=np.int)
+        gkeys = np.array(sorted(k for k in glyphs if glyphs[k]['type'] == 'object'), dtype=np.int64)
+        self.keys = gkeys
+        self.names = np.array([glyphs[k]['data']['name'] for k in gkeys])
+        self.classes = np.array([glyphs[k]['data']['class'] for k in gkeys], dtype=np.int8)
         self.minkey = gkeys.min()
         self.maxkey = gkeys.max()
 
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Rebuild from the arrays of to_arrays, without the glyph dict.
+        """
+        objects = cls.__new__(cls)
+        objects.keys = arrays['keys']
+        objects.names = arrays['names']
+        objects.classes = arrays['classes']
+        objects.minkey = int(objects.keys.min())
+        objects.maxkey = int(objects.keys.max())
+        return objects
+
+    def to_arrays(self):
+        return {'keys': self.keys, 'names': self.names, 'classes': self.classes}
+
     def get_object(self, index: int):
-        obj_type = self.glyphs[index]['type']
-        if obj_type != 'object':
-            raise ValueError("Index {} is type '{}', not 'object' ".format(index, obj_type))
-        d = self.glyphs[index]['data']
+        i = np.searchsorted(self.keys, index)
+        if i == len(self.keys) or self.keys[i] != index:
+            raise ValueError("Index {} is not an 'object' ".format(index))
+        obj_class = int(self.classes[i])
+
+        obj = {'name':str(self.names[i]), 'class':obj_class, 'info':self.object_classes[obj_class]}
+        return obj
+
+    def feature_table(self, num_glyphs):
+        """
+        (num_glyphs, 18) float32 features per glyph, an object flag then a
+        one hot of the object class, zero for anything that is not an object.
+        """
+        table = np.zeros((num_glyphs, 1 + len(self.object_classes)), dtype=np.float32)
+        table[self.keys, 0] = 1
+        table[self.keys, self.classes] = 1
+        return table
 
-        obj = {'name':d['name'], 'class':d['class'], 'info':self.object_classes[d['class']]}
-        return obj
\ No newline at end of file
+    @property
+    def feature_names(self):
+        return ['object'] + ['object_' + self.object_classes[c].replace(' ', '_')
+                             for c in sorted(self.object_classes)]
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:03:47 2026
+
+@author: dandrews
+
+Append only session recordings. Every chunk of telnet data fed to the
+terminal is written as a record of (timestamp, command, data), command
+being the bytes sent that produced it, if any. Feeding the data of a
+recording back in order rebuilds every screen of the session.
+
+File layout, all little endian:
+    b'NHREC' version:uint8
+    blocks of codec:uint8 compressed_size:uint32 size:uint32 payload
+A payload, once decompressed, is records of
+    timestamp:float64 command_size:uint32 data_size:uint32 command data
+Records are buffered into blocks of about block_size bytes so they can be
+compressed with zstd, lz4 or zlib. A crash loses at most the open block,
+a block it cut off is truncated away when the recording is next opened.
+"""
+from collections import namedtuple
+import os
+import struct
+import time
+
+Record = namedtuple('record', 'timestamp command data')
+
+RECORDING_VERSION = 1
+_MAGIC = b'NHREC'
+_file_header = struct.Struct('<5sB')
+_block_header = struct.Struct('<BII')
+_record_header = struct.Struct('<dII')
+
+CODECS = ['none', 'zlib', 'zstd', 'lz4']
+
+
+def _compressor(codec):
+    if codec == 'none':
+        return lambda data: data
+    if codec == 'zlib':
+        import zlib
+        return lambda data: zlib.compress(data, 1)
+    if codec == 'zstd':
+        import zstandard # optional
+        return zstandard.ZstdCompressor(level=3).compress
+    if codec == 'lz4':
+        import lz4.block # optional
+        return lambda data: lz4.block.compress(data, store_size=False)
+    raise ValueError("Unknown codec {}, expected one of {}".format(codec, CODECS))
+
+
+def _decompressor(codec):
+    if codec == 'none':
+        return lambda data, size: data
+    if codec == 'zlib':
+        import zlib
+        return lambda data, size: zlib.decompress(data)
+    if codec == 'zstd':
+        import zstandard # optional
+        decompress = zstandard.ZstdDecompressor().decompress
+        return lambda data, size: decompress(data, max_output_size=size)
+    if codec == 'lz4':
+        import lz4.block # optional
+        return lambda data, size: lz4.block.decompress(data, uncompressed_size=size)
+    raise ValueError("Unknown codec {}, expected one of {}".format(codec, CODECS))
+
+
+class SessionRecorder():
+    """
+    Appends records to a recording, creating it if needed.
+        recorder = SessionRecorder('recordings/aa.nhrec', compression='zstd')
+        recorder.write(b'8', data)
+        recorder.close()
+    Writing is amortized O(1), nothing already written is touched again.
+    """
+    def __init__(self, file_name, compression=None, block_size=64 * 1024):
+        self.file_name = file_name
+        self.codec = compression or 'none'
+        self._compress = _compressor(self.codec)
+        self.block_size = block_size
+        self._block = []
+        self._block_bytes = 0
+        self.records = 0
+
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        mode = 'r+b' if os.path.exists(file_name) else 'w+b'
+        self._file = open(file_name, mode)
+        end = self._complete_length()
+        self._file.seek(end)
+        self._file.truncate()
+        if end == 0:
+            self._file.write(_file_header.pack(_MAGIC, RECORDING_VERSION))
+
+    def _complete_length(self):
+        """
+        Length of the file up to the end of its last complete block, 0 if
+        it does not even have a whole file header.
+        """
+        record_file = self._file
+        record_file.seek(0, os.SEEK_END)
+        size = record_file.tell()
+        record_file.seek(0)
+        header = record_file.read(_file_header.size)
+        if len(header) < _file_header.size:
+            return 0
+        magic, version = _file_header.unpack(header)
+        if magic != _MAGIC or version != RECORDING_VERSION:
+            record_file.close()
+            raise ValueError("{} is not a version {} recording".format(
+                    self.file_name, RECORDING_VERSION))
+        end = _file_header.size
+        while True:
+            header = record_file.read(_block_header.size)
+            if len(header) < _block_header.size:
+                return end
+            _, compressed_size, _ = _block_header.unpack(header)
+            block_end = end + _block_header.size + compressed_size
+            if block_end > size:
+                return end
+            record_file.seek(block_end)
+            end = block_end
+
+    def write(self, command, data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        self._block.append(_record_header.pack(timestamp, len(command), len(data)))
+        self._block.append(command)
+        self._block.append(data)
+        self._block_bytes += _record_header.size + len(command) + len(data)
+        self.records += 1
+        if self._block_bytes >= self.block_size:
+            self._write_block()
+
+    def _write_block(self):
+        if not self._block:
+            return
+        raw = b''.join(self._block)
+        payload = self._compress(raw)
+        self._file.write(_block_header.pack(CODECS.index(self.codec), len(payload), len(raw)))
+        self._file.write(payload)
+        self._block = []
+        self._block_bytes = 0
+
+    def flush(self):
+        """
+        Write out the open block, everything recorded so far is on disk after.
+        """
+        if self._file is None:
+            return
+        self._write_block()
+        self._file.flush()
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+class SessionReader():
+    """
+    Streams the records of a recording lazily, one block in memory at a
+    time.
+        for timestamp, command, data in SessionReader('recordings/aa.nhrec'):
+            ...
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def __iter__(self):
+        decompressors = {}
+        with open(self.file_name, 'rb') as record_file:
+            header = record_file.read(_file_header.size)
+            magic, version = _file_header.unpack(header)
+            if magic != _MAGIC or version != RECORDING_VERSION:
+                raise ValueError("{} is not a version {} recording".format(
+                        self.file_name, RECORDING_VERSION))
+            while True:
+                header = record_file.read(_block_header.size)
+                if len(header) < _block_header.size:
+                    return # end of file, or a block cut off by a crash
+                codec, compressed_size, size = _block_header.unpack(header)
+                payload = record_file.read(compressed_size)
+                if len(payload) < compressed_size:
+                    return
+                if codec not in decompressors:
+                    decompressors[codec] = _decompressor(CODECS[codec])
+                block = memoryview(decompressors[codec](payload, size))
+                offset = 0
+                while offset < len(block):
+                    if offset + _record_header.size > len(block):
+                        raise ValueError("Corrupt block in {}".format(self.file_name))
+                    timestamp, command_size, data_size = \
+                        _record_header.unpack_from(block, offset)
+                    offset += _record_header.size
+                    if offset + command_size + data_size > len(block):
+                        raise ValueError("Corrupt block in {}".format(self.file_name))
+                    command = bytes(block[offset:offset + command_size])
+                    offset += command_size
+                    data = bytes(block[offset:offset + data_size])
+                    offset += data_size
+                    yield Record(timestamp, command, data)
+
+    def data(self):
+        """
+        Just the fed data of every record, e.g. for NhInterface._feed.
+        """
+        return (record.data for record in self)
+
+
+if __name__ == '__main__':
+    from nhdata import NhData
+    import tempfile
+
+#%%
+    def benchmark_recorder(reps=2000):
+        """
+        Write and read back the SAMPLE_DATA frames with every codec
+        available, printing the rates and file sizes.
+        """
+        frames = NhData.SAMPLE_DATA
+        megabytes = reps * sum(len(f) for f in frames) / 1e6
+        for codec in CODECS:
+            try:
+                _compressor(codec)
+            except ImportError:
+                print("{}: not installed".format(codec))
+                continue
+            with tempfile.TemporaryDirectory() as directory:
+                file_name = os.path.join(directory, 'bench.nhrec')
+                start = time.monotonic()
+                with SessionRecorder(file_name, codec) as recorder:
+                    for _ in range(reps):
+                        for f in frames:
+                            recorder.write(b'8', f)
+                write_rate = megabytes / (time.monotonic() - start)
+                start = time.monotonic()
+                count = sum(1 for _ in SessionReader(file_name))
+                read_rate = megabytes / (time.monotonic() - start)
+                assert count == reps * len(frames)
+                print("{}: write {:.0f} MB/s, read {:.0f} MB/s, {:.1f}x smaller".format(
+                        codec, write_rate, read_rate,
+                        megabytes * 1e6 / os.path.getsize(file_name)))
+
+    benchmark_recorder()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:16:22 2026
+
+@author: dandrews
+
+Offline replay of recorded sessions. The game's output is a pure byte
+stream, so feeding a recording back through the terminal rebuilds every
+screen, observation and state without a server. Useful to regenerate
+observations in new formats, to benchmark the parser and features at full
+CPU speed and for regression checks.
+"""
+from nh_interface import NhInterface
+from nhdata import NhData
+from recorder import Record, SessionReader
+import multiprocessing
+import numpy as np
+import os
+
+
+class ReplayInterface(NhInterface):
+    """
+    NhInterface driven by recorded (timestamp, command, data) records
+    instead of telnet. Every send consumes the next record, whatever was
+    sent, so a recording replays exactly as it was played. Reads with no
+    command, like _read_states, consume the records that came in
+    unprompted. Once the records run out sends read nothing.
+        nhi = ReplayInterface.from_file('nh_progress/aa.nhrec')
+        for record in nhi:
+            nhi.buffer_to_rgb(), nhi.get_status()
+    """
+    def __init__(self, records=(), username='replay'):
+        self.username = username
+        self._init_screen()
+        self._init_history()
+        self.records = iter(records)
+        self._next = None
+        self.commands_mismatched = 0
+
+    @classmethod
+    def from_file(cls, file_name):
+        username = os.path.splitext(os.path.basename(file_name))[0]
+        return cls(SessionReader(file_name), username)
+
+    @classmethod
+    def from_sample_data(cls):
+        return cls(Record(0.0, b'', data) for data in NhData.SAMPLE_DATA)
+
+    def _peek(self):
+        if self._next is None:
+            self._next = next(self.records, None)
+        return self._next
+
+    def _pop(self):
+        record = self._peek()
+        self._next = None
+        return record
+
+    def step(self):
+        """
+        Feed the next record, whatever its command. Returns the record or
+        None at the end of the recording.
+        """
+        record = self._pop()
+        if record is not None:
+            self._feed(record.data, record.command)
+            self._parse_states()
+        return record
+
+    def __iter__(self):
+        """
+        Feeds the recording one record at a time, yielding each record
+        after its data is on screen.
+        """
+        while True:
+            record = self.step()
+            if record is None:
+                return
+            yield record
+
+    def _connect_with_retry(self):
+        return None
+
+    def start_session(self):
+        self._read_states()
+
+    def reset_game(self):
+        self._read_states()
+
+    def send_and_read_to_prompt(self, prompt, message, timeout=2):
+        if type(message) == str:
+            message = message.encode('ascii')
+        record = self._pop()
+        if record is None:
+            return b''
+        if record.command != message:
+            self.commands_mismatched += 1
+            self.logger.debug("sent {} but recorded {}".format(message, record.command))
+        self._feed(record.data, record.command)
+        self._read_states()
+        return record.data
+
+    def send_keys(self, keys, prompt=NhInterface.INPUT_WAIT, timeout=2):
+        return self.send_and_read_to_prompt(prompt, keys, timeout)
+
+    def _read_states(self):
+        while self._peek() is not None and not self._next.command:
+            record = self._pop()
+            self._feed(record.data)
+        self._parse_states()
+
+
+OUTPUTS = ['glyphs', 'status', 'rgb', 'features']
+
+
+def convert_recording(file_name, output_dir, outputs=('glyphs', 'status'),
+                      observation_dtype=np.uint8):
+    """
+    Replay one recording, saving the observation after every record to
+    output_dir/<name>.npz with arrays timestamps, commands and each of
+    outputs:
+        glyphs   (n, 21, 80) int16 collapsed glyphs
+        status   (n,) NhData.STATUS_DTYPE records
+        rgb      (n, 21, 80, 3) observation_dtype
+        features (n, F + 1, 21, 80) float32 feature planes
+    Returns the output file name and the number of records.
+    """
+    for output in outputs:
+        if output not in OUTPUTS:
+            raise ValueError("Unknown output {}, expected one of {}".format(output, OUTPUTS))
+    nhi = ReplayInterface.from_file(file_name)
+    nhi.set_observation_dtype(observation_dtype)
+    columns = {name: [] for name in ['timestamps', 'commands'] + list(outputs)}
+    for record in nhi:
+        columns['timestamps'].append(record.timestamp)
+        columns['commands'].append(record.command)
+        if 'glyphs' in outputs:
+            columns['glyphs'].append(nhi.buffer_to_npdata().astype(np.int16))
+        if 'status' in outputs:
+            columns['status'].append(nhi.get_status())
+        if 'rgb' in outputs:
+            columns['rgb'].append(nhi.buffer_to_rgb())
+        if 'features' in outputs:
+            columns['features'].append(nhi.buffer_to_features().copy())
+
+    arrays = {'timestamps': np.array(columns['timestamps'], dtype=np.float64),
+              'commands': np.array(columns['commands'], dtype=bytes)}
+    for output in outputs:
+        if output == 'status':
+            arrays[output] = np.array(columns[output], dtype=NhData.STATUS_DTYPE)
+        elif columns[output]:
+            arrays[output] = np.stack(columns[output])
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    out_name = os.path.join(output_dir, stem + '.npz')
+    np.savez_compressed(out_name, **arrays)
+    return out_name, len(arrays['timestamps'])
+
+
+def _convert(args):
+    return convert_recording(*args)
+
+
+def convert_recordings(recording_dir, output_dir, outputs=('glyphs', 'status'),
+                       observation_dtype=np.uint8, processes=None):
+    """
+    Convert every .nhrec recording in recording_dir with convert_recording,
+    one recording per process. Returns {output file: records}.
+    """
+    names = sorted(os.path.join(recording_dir, n) for n in os.listdir(recording_dir)
+                   if n.endswith('.nhrec'))
+    jobs = [(name, output_dir, tuple(outputs), observation_dtype) for name in names]
+    with multiprocessing.Pool(processes) as pool:
+        return dict(pool.imap_unordered(_convert, jobs))
+
+
+if __name__ == '__main__':
+    import time
+
+#%%
+    def benchmark_replay(reps=200):
+        """
+        Records per second through the terminal, observation and status
+        with no server, for pyte and NhTerminal.
+        """
+        for native in (False, True):
+            ReplayInterface.NATIVE_TERMINAL = native
+            start = time.monotonic()
+            for _ in range(reps):
+                nhi = ReplayInterface.from_sample_data()
+                for record in nhi:
+                    nhi.buffer_to_rgb()
+                    nhi.get_status()
+            rate = reps * len(NhData.SAMPLE_DATA) / (time.monotonic() - start)
+            print("{}: {:.0f} records/s".format('NhTerminal' if native else 'pyte', rate))
+        ReplayInterface.NATIVE_TERMINAL = False
+
+    benchmark_replay()
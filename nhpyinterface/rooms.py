@@ -38,10 +38,11 @@ class RoomTiles():
     _swallow = [i for i in range(905, 921)]
 
     def __init__(self, glyphs):
-        self.gsets = {l: set(self.GLYPH_COLLECTIONS[l][1:]) for l in range(len(self.GLYPH_COLLECTIONS))}
-        self.glyph_map = []
-        for i in range(2000):
-            self.glyph_map.append(self._collapse_glyph(i))
+        self._init_gsets()
+        # Contiguous lookup table so whole glyph arrays can be collapsed
+        # with a single gather, e.g. glyph_map[screen_glyphs]
+        self.glyph_map = np.array([self._collapse_glyph(i) for i in range(2000)],
+                                  dtype=np.int32)
 
         room_keys = np.array([k for k in glyphs if glyphs[k]['type'] == 'room'], dtype=np.int)
         self.minkey = room_keys.min()
@@ -51,7 +52,27 @@ class RoomTiles():
         self._room_data = self._normalize_room_data(room_keys, trap_keys)
         self._room_data = self._compact_room_data(self._room_data)
 
+    def _init_gsets(self):
+        self.gsets = {l: set(self.GLYPH_COLLECTIONS[l][1:]) for l in range(len(self.GLYPH_COLLECTIONS))}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Rebuild from the arrays of to_arrays, without the glyph dict.
+        """
+        rooms = cls.__new__(cls)
+        rooms._init_gsets()
+        rooms.glyph_map = arrays['glyph_map']
+        rooms.minkey = int(arrays['minkey'])
+        rooms.maxkey = int(arrays['maxkey'])
+        rooms._room_data = arrays['room_data']
+        return rooms
 
+    def to_arrays(self):
+        return {'glyph_map': self.glyph_map,
+                'minkey': np.array(self.minkey),
+                'maxkey': np.array(self.maxkey),
+                'room_data': self._room_data}
 
 
     def collapse_glyph(self, glyph):
@@ -112,6 +133,24 @@ class RoomTiles():
         index = glyph_num - self.minkey
         return self._room_data[index]
 
+    def feature_table(self, num_glyphs):
+        """
+        (num_glyphs, 46) float32 features per glyph, the room one hot then
+        the trap one hot of get_room_data, zero outside the rooms range.
+        """
+        width = self._room_data.shape[1] * self._room_data.shape[2]
+        table = np.zeros((num_glyphs, width), dtype=np.float32)
+        keys = np.arange(self.minkey, min(self.maxkey + 1, num_glyphs))
+        index = np.minimum(keys, self._max_trap) - self.minkey
+        table[keys] = self._room_data[index].reshape(len(keys), width)
+        return table
+
+    @property
+    def feature_names(self):
+        size = self._room_data.shape[2]
+        return ['room_{}'.format(i) for i in range(size)] + \
+               ['trap_{}'.format(i) for i in range(size)]
+
 if __name__ == '__main__':
     import pickle
     glyph_pickle_file = "glyphs.pkl"
@@ -4,31 +4,144 @@ Created on Tue Jan  9 13:47:08 2018
 
 @author: http://programarcadegames.com/python_examples/en/sprite_sheets/
 This module is used to pull individual sprites from sprite sheets.
+
+Sheets are decoded once per process and cut into tile atlases that are
+saved next to the sheets as .npy files. Later loads memory map those files
+read only, so every environment in a process, and every process on the
+machine, shares the same pages.
 """
-import scipy.ndimage
+import numpy as np
+import os
+import struct
+
+ATLAS_CACHE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                               "sprite_sheets", "atlas_cache")
+SHEET_TILE_SIZE = 32
+
+_sheets = {}
+_atlases = {}
+
+
+def read_bmp(file_name):
+    """
+    Decode an uncompressed 24 or 32 bit BMP into a (h, w, 3) uint8 RGB array.
+    """
+    with open(file_name, 'rb') as bmp_file:
+        data = bmp_file.read()
+    magic, _, _, _, offset = struct.unpack_from('<2sIHHI', data, 0)
+    _, width, height, _, bpp, compression = struct.unpack_from('<IiiHHI', data, 14)
+    if magic != b'BM' or compression not in (0, 3) or bpp not in (24, 32):
+        raise ValueError("{} is not an uncompressed 24/32 bit BMP".format(file_name))
+    channels = bpp // 8
+    stride = (width * channels + 3) & ~3 # rows are padded to 4 bytes
+    rows = np.frombuffer(data, dtype=np.uint8, count=stride * abs(height), offset=offset)
+    pixels = rows.reshape(abs(height), stride)[:, :width * channels]
+    pixels = pixels.reshape(abs(height), width, channels)[:, :, 2::-1] # BGR -> RGB
+    if height > 0: # bottom up
+        pixels = pixels[::-1]
+    return np.ascontiguousarray(pixels)
+
+
+def read_sheet(file_name):
+    """
+    The decoded sheet, decoded at most once per process.
+    """
+    file_name = os.path.abspath(file_name)
+    if file_name not in _sheets:
+        _sheets[file_name] = read_bmp(file_name)
+    return _sheets[file_name]
+
+
+def build_atlas(sheet, tile_size=SHEET_TILE_SIZE, sheet_tile_size=SHEET_TILE_SIZE):
+    """
+    Cut a sheet into a (num_tiles, tile_size, tile_size, 3) uint8 array,
+    tile n is atlas[n] counting left to right, top to bottom. Tiles are
+    scaled from sheet_tile_size by nearest neighbour.
+    """
+    h = w = sheet_tile_size
+    tile_rows = sheet.shape[0] // h
+    tile_cols = sheet.shape[1] // w
+    atlas = sheet[:tile_rows * h, :tile_cols * w, :3]
+    atlas = atlas.reshape(tile_rows, h, tile_cols, w, 3).swapaxes(1, 2).reshape(-1, h, w, 3)
+    if tile_size != sheet_tile_size:
+        index = np.arange(tile_size) * sheet_tile_size // tile_size
+        atlas = atlas[:, index][:, :, index]
+    return np.ascontiguousarray(atlas, dtype=np.uint8)
+
+
+def load_atlas(file_name, tile_size=SHEET_TILE_SIZE, cache_dir=ATLAS_CACHE_DIR):
+    """
+    Read only (num_tiles, tile_size, tile_size, 3) atlas of a sheet, shared
+    by every caller in the process. The atlas is memory mapped from
+    cache_dir, and built and saved there first if it is missing or older
+    than the sheet. Without a writable cache_dir it is kept in memory.
+    """
+    file_name = os.path.abspath(file_name)
+    key = (file_name, tile_size)
+    if key in _atlases:
+        return _atlases[key]
+
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    cache_name = os.path.join(cache_dir, "{}_{}.npy".format(stem, tile_size))
+    atlas = None
+    if os.path.exists(cache_name) and \
+        os.path.getmtime(cache_name) >= os.path.getmtime(file_name):
+        atlas = np.load(cache_name, mmap_mode='r')
+    else:
+        built = build_atlas(read_sheet(file_name), tile_size)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write then rename so concurrent workers never see half a file
+            temp_name = "{}.{}.tmp".format(cache_name, os.getpid())
+            with open(temp_name, 'wb') as temp_file:
+                np.save(temp_file, built)
+            os.replace(temp_name, cache_name)
+            atlas = np.load(cache_name, mmap_mode='r')
+        except OSError:
+            atlas = built
+            atlas.setflags(write=False)
+    _atlases[key] = atlas
+    return atlas
+
 
 class SpriteSheet(object):
     """ Class used to grab images out of a sprite sheet. """
 
     def __init__(self, file_name, rows, columns):
         """ Constructor. Pass in the file name of the sprite sheet. """
+        self.file_name = file_name
         self.rows = rows
         self.columns = columns
 
-        self.sheet = scipy.ndimage.imread(file_name)
 #        self.sprite_h = self.sheet.shape[0] // columns
 #        self.sprite_w = self.sheet.shape[1] // rows
-        self.sprite_h = 32
-        self.sprite_w = 32
+        self.sprite_h = SHEET_TILE_SIZE
+        self.sprite_w = SHEET_TILE_SIZE
+        self.atlas = load_atlas(file_name, self.sprite_h)
+
+    @property
+    def sheet(self):
+        return read_sheet(self.file_name)
+
+    def get_atlas(self, tile_size=32):
+        """
+        The atlas with tiles scaled to tile_size square by nearest neighbour,
+        e.g. 8, 16 or 32.
+        """
+        return load_atlas(self.file_name, tile_size)
+
+    def render(self, glyphs, tile_size=32):
+        """
+        Image of a 2D glyph array in one gather, shape
+        (rows * tile_size, cols * tile_size, 3) uint8.
+        """
+        atlas = self.get_atlas(tile_size)
+        rows, cols = glyphs.shape
+        tiles = atlas[glyphs] # rows, cols, tile_size, tile_size, 3
+        return tiles.swapaxes(1, 2).reshape(rows * tile_size, cols * tile_size, 3)
 
     def get_image_by_number(self, num):
-        row = num // self.rows
-        col = num - (row * self.rows)
-        top = row * self.sprite_h
-        left = col * self.sprite_w
-        #print("row:{}, col:{}, glyph:{}".format(row, col, num))
-        image = self.get_image(top, left,self.sprite_h, self.sprite_w )
-        return image
+        return self.atlas[num]
 
 
     def get_image(self, x, y, width, height):
@@ -40,6 +153,7 @@ class SpriteSheet(object):
         return image
 
     def plot_small_glyph(self, glyph_num):
+        import matplotlib.pyplot as plt
         fig = plt.figure(frameon=False)
         fig.set_size_inches(0.5,0.5)
         ax = fig.add_axes([0,0,1,1])
@@ -53,3 +167,16 @@ if __name__ == '__main__':
     ss = SpriteSheet("sprite_sheets/chozo32.bmp",40,30)
     ss.plot_small_glyph(431)
 
+#%%
+    def build_all_atlases(tile_sizes=(8, 16, 32)):
+        """
+        Prebuild the atlas cache for every sheet, e.g. before starting workers.
+        """
+        sheet_dir = os.path.dirname(ATLAS_CACHE_DIR)
+        for name in sorted(os.listdir(sheet_dir)):
+            if name.endswith('.bmp'):
+                for size in tile_sizes:
+                    atlas = load_atlas(os.path.join(sheet_dir, name), size)
+                    print(name, size, atlas.shape)
+
+    build_all_atlases()
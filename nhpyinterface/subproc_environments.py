@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:20:41 2026
+
+@author: dandrews
+
+Runs NhEnv instances in worker processes so feature extraction is not
+serialized by the GIL. Step results are written by the workers straight
+into a BatchBuffer in shared memory, the pipes only carry commands.
+"""
+from multiprocessing import shared_memory
+from batch_buffer import BatchBuffer
+import multiprocessing
+import numpy as np
+import logging
+import traceback
+
+
+def _worker(remote, parent_remote, username, shm_name, index, batch_args):
+    """
+    Process loop for one environment. Commands arrive as (cmd, data) and
+    results are written to this environment's row of the shared batch.
+    """
+    parent_remote.close()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    batch = BatchBuffer(buffer=shm.buf, **batch_args)
+    env = None
+    try:
+        from nh_environment import NhEnv
+        env = NhEnv(username, batch_args['obs_dtype'])
+        remote.send(('ok', None))
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                slot, last, action, strategy = data
+                if env.is_done:
+                    batch.store(slot, index, None, action, 0, batch.s_[last, index],
+                                True, batch.infos[last, index])
+                else:
+                    _, r, t, info = env.step(action, strategy, batch.s_[slot, index])
+                    batch.store(slot, index, None, action, r, None, t, info)
+                remote.send(('ok', None))
+            elif cmd == 'reset':
+                slot = data
+                batch.store(slot, index, None, 0, 0, env.reset(), False, env.get_info())
+                remote.send(('ok', None))
+            elif cmd == 'turn':
+                remote.send(('ok', env.nhi.get_status()['t']))
+            elif cmd == 'close':
+                remote.send(('ok', env.close()))
+                env = None
+                break
+    except (KeyboardInterrupt, EOFError):
+        pass
+    except Exception:
+        remote.send(('error', traceback.format_exc()))
+    finally:
+        if env is not None:
+            env.close()
+        del batch
+        shm.close()
+        remote.close()
+
+
+class SubprocEnvironments():
+    """
+    A batch of NhEnv, one per worker process, stepped together.
+        envs = SubprocEnvironments(8)
+        obs = envs.reset()
+        obs, rewards, dones, infos = envs.step(actions)
+    The returned arrays are views into the shared BatchBuffer ring and stay
+    valid for capacity - 1 further steps, copy them if they must be kept.
+    obs_dtype=np.uint8 makes the observations 0-255 bytes, a quarter of
+    the shared memory and copies of the float32 default.
+    """
+    logger = logging.getLogger(__name__)
+    output_shape = (84, 84, 3)
+    info_size = 2
+    # Seconds to wait on each worker when closing before it is terminated
+    close_timeout = 10
+
+    def __init__(self, num, prefix='bot', obs_dtype=np.float32, capacity=2,
+                 start_method=None):
+        self.num_envs = num
+        self.closed = False
+        batch_args = dict(num_envs=num, obs_shape=self.output_shape,
+                          obs_dtype=obs_dtype, info_size=self.info_size,
+                          capacity=capacity, with_states=False)
+        self._shm = shared_memory.SharedMemory(create=True,
+                                               size=BatchBuffer.nbytes(**batch_args))
+        self.batch = BatchBuffer(buffer=self._shm.buf, **batch_args)
+
+        ctx = multiprocessing.get_context(start_method)
+        self.remotes, self.processes = [], []
+        for i in range(num):
+            remote, work_remote = ctx.Pipe()
+            name = '{}{:03}'.format(prefix, i)
+            args = (work_remote, remote, name, self._shm.name, i, batch_args)
+            process = ctx.Process(target=_worker, args=args, name=name, daemon=True)
+            process.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+        self._recv_all(self.remotes)
+
+    def _recv(self, remote):
+        status, data = remote.recv()
+        if status == 'error':
+            raise RuntimeError("Environment worker failed\n" + data)
+        return data
+
+    def _recv_all(self, remotes):
+        return [self._recv(remote) for remote in remotes]
+
+    def _reset(self, indices):
+        last = self.batch.slot
+        slot = self.batch.advance()
+        b = self.batch
+        # Environments that are not reset carry their last results forward
+        b.s_[slot], b.rewards[slot], b.dones[slot], b.infos[slot] = \
+            b.s_[last], b.rewards[last], b.dones[last], b.infos[last]
+        for i in indices:
+            self.remotes[i].send(('reset', slot))
+        self._recv_all([self.remotes[i] for i in indices])
+        return b.s_[slot]
+
+    def reset(self):
+        """
+        Start a new game in every environment
+        """
+        return self._reset(range(self.num_envs))
+
+    def reset_done(self):
+        """
+        Start a new game only in the environments that finished
+        """
+        done = np.flatnonzero(self.batch.dones[self.batch.slot])
+        return self._reset(done)
+
+    def step(self, actions, strategies=None):
+        """
+        Step every environment. Finished environments are skipped and keep
+        reporting done until reset_done is called.
+        Returns observations, rewards, dones, infos as stacked arrays.
+        """
+        if strategies is None:
+            strategies = np.zeros(self.num_envs, dtype=int)
+        last = self.batch.slot
+        slot = self.batch.advance()
+        for remote, action, strategy in zip(self.remotes, actions, strategies):
+            remote.send(('step', (slot, last, int(action), int(strategy))))
+        self._recv_all(self.remotes)
+        batch = self.batch.views(slot)
+        return batch.s_, batch.rewards, batch.dones, batch.infos
+
+    def get_env_turns(self):
+        for remote in self.remotes:
+            remote.send(('turn', None))
+        return np.array(self._recv_all(self.remotes))
+
+    def close(self):
+        # __init__ may have failed part way, close whatever it got to
+        if getattr(self, 'closed', True):
+            return
+        remotes = getattr(self, 'remotes', [])
+        for remote in remotes:
+            try:
+                remote.send(('close', None))
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+        for remote in remotes:
+            try:
+                if remote.poll(self.close_timeout):
+                    self._recv(remote)
+                else:
+                    self.logger.warning("close: worker did not answer")
+            except (EOFError, OSError, RuntimeError) as exc:
+                self.logger.warning("close: {}".format(exc))
+            remote.close()
+        for process in getattr(self, 'processes', []):
+            process.join(self.close_timeout)
+            if process.is_alive():
+                self.logger.warning("close: terminating {}".format(process.name))
+                process.terminate()
+                process.join(self.close_timeout)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        if hasattr(self, 'batch'):
+            del self.batch
+        if getattr(self, '_shm', None) is not None:
+            self._shm.close()
+            self._shm.unlink()
+        self.closed = True
+
+    def __del__(self):
+        self.close()
+
+
+if __name__ == '__main__':
+    import time
+    log_format ='(%(processName)-0s) %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s'
+    logging.basicConfig(level=logging.WARNING, format=log_format)
+
+#%%
+    def time_steps(num, steps=100):
+        results = {}
+        for i in num:
+            envs = SubprocEnvironments(i)
+            envs.reset()
+            start = time.monotonic()
+            for _ in range(steps):
+                envs.step(np.random.randint(1, 10, size=i))
+                envs.reset_done()
+            elapsed = time.monotonic() - start
+            print(i, elapsed)
+            results[i] = elapsed
+            envs.close()
+        return results
+
+    data = time_steps([1, 2, 4, 8, 16, 32, 64])
+    for d in data:
+            print("{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}".format(d, data[d], d * 100, (d*100)/data[d]))
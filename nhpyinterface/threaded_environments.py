@@ -6,16 +6,55 @@ Created on Sun Feb 18 09:24:13 2018
 """
 import concurrent.futures
 from nh_environment import NhEnv
+from batch_buffer import BatchBuffer
+from nhdata import NhData
+from metrics import merge_snapshots, to_prometheus
 import inspect
 import logging
+import numpy as np
+import queue
+import threading
 import time
 
 
+class EnvWorker(threading.Thread):
+    """
+    Long lived thread pinned to one environment. Calls are queued and run
+    in order, each returns a concurrent.futures.Future.
+    """
+    def __init__(self, name):
+        super().__init__(name=name, daemon=True)
+        self.calls = queue.Queue()
+        self.start()
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        self.calls.put((future, fn, args))
+        return future
+
+    def stop(self):
+        self.calls.put(None)
+
+    def run(self):
+        while True:
+            call = self.calls.get()
+            if call is None:
+                return
+            future, fn, args = call
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as exc:
+                future.set_exception(exc)
+
 
 class MultiThreadEnvironments():
     logger = logging.getLogger()
     thread_timeout = 300
     envs = []
+    obs_dtype = np.float32 # np.uint8 for compact batches, see NhEnv.observation_dtype
+    batch_capacity = 2
 
     def __init__(self, callback):
         """
@@ -24,74 +63,149 @@ class MultiThreadEnvironments():
         """
         assert inspect.isfunction(callback) or inspect.ismethod(callback)
         self.callback = callback
+        self.workers = {}
+        self.batch = None
+
+    def _wait(self, futures):
+        """
+        Block until every future in the {future: env} dict is done.
+        Returns a dictionary of {environments:results}
+        """
+        results = {}
+        for future in concurrent.futures.as_completed(futures, self.thread_timeout):
+            results[futures[future]] = future.result()
+        return results
+
+    def submit_steps(self):
+        """
+        Queue one step_with_callback on every running environment without
+        waiting. Returns a dictionary of {future:environment}
+        """
+        if not self.envs:
+            raise ValueError("Must call create_envs first")
+        return {self.workers[e].submit(e.step_with_callback, self.callback): e \
+                for e in self.envs if not e.is_done}
 
     def step_environments(self):
         self.logger.debug("Stepping all enviroments.")
+        return self._wait(self.submit_steps())
+
+    def step_batch(self):
+        """
+        Step every running environment, each writing into its own row of a
+        preallocated BatchBuffer. Returns a Batch of views (s, actions,
+        rewards, s_, dones, infos) that stay valid for batch_capacity - 1
+        further steps. Finished environments repeat their last row as done.
+        """
         if not self.envs:
             raise ValueError("Must call create_envs first")
-        results = {}
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = {executor.submit(e.step_with_callback,self.callback): e \
-                       for e in self.envs if not e.is_done}
-            for future in concurrent.futures.as_completed(futures, self.thread_timeout):
-                results[futures[future]] = future.result()
-
-        return results
+        if self.batch is None or self.batch.num_envs != len(self.envs):
+            self.batch = BatchBuffer(len(self.envs), self.envs[0].observation_shape,
+                                     self.obs_dtype, capacity=self.batch_capacity)
+        last = self.batch.slot
+        slot = self.batch.advance()
+        futures = {}
+        for i, e in enumerate(self.envs):
+            if e.is_done:
+                b = self.batch
+                b.store(slot, i, None if b.s is None else b.s[last, i],
+                        b.actions[last, i], 0, b.s_[last, i], True, b.infos[last, i])
+            else:
+                futures[self.workers[e].submit(e.step_into, self.callback,
+                                               self.batch, slot, i)] = e
+        self._wait(futures)
+        return self.batch.views(slot)
 
     def reset_all_environments(self):
         """
-        Runs each environment on a thread with the callback
+        Resets each environment on its own thread
         Returns a dictionary of {environments:results}
         """
         if not self.envs:
             raise ValueError("Must call create_envs first")
-        results = {}
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = {executor.submit(e.reset):e for e in self.envs}
-            for future in concurrent.futures.as_completed(futures, self.thread_timeout):
-                results[futures[future]] = future.result()
-        return results
+        futures = {self.workers[e].submit(e.reset):e for e in self.envs}
+        return self._wait(futures)
 
     def reset_done_environments(self):
         if not self.envs:
             raise ValueError("Must call create_envs first")
-        results = {}
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = {executor.submit(e.reset):e for e in self.envs if e.is_done}
-            for future in concurrent.futures.as_completed(futures, self.thread_timeout):
-                results[futures[future]] = future.result()
+        futures = {self.workers[e].submit(e.reset):e for e in self.envs if e.is_done}
+        return self._wait(futures)
 
     def create_envs(self, num):
-        futures = []
+        futures = {}
         envs = []
         complete = 0
         # initial connect may be throttled or thread starvation problems
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            for i in range(num):
-                self.logger.debug("queued {}".format(i + complete))
-                name = 'bot{:03}'.format(i)
-                f = executor.submit(NhEnv, name)
-                futures.append(f)
-                time.sleep(0.1) # don't hit throttles
-            for future in concurrent.futures.as_completed(futures, self.thread_timeout):
-                try:
-                    e = future.result()
-                    envs.append(e)
-                except Exception as exc:
-                    self.logger.error("create env exception {}".format(exc))
-                complete += 1
-                self.logger.debug("completed {}", complete)
+        for i in range(num):
+            self.logger.debug("queued {}".format(i + complete))
+            name = 'bot{:03}'.format(i)
+            worker = EnvWorker(name)
+            futures[worker.submit(NhEnv, name, self.obs_dtype)] = worker
+            time.sleep(0.1) # don't hit throttles
+        workers = {}
+        for future in concurrent.futures.as_completed(futures, self.thread_timeout):
+            worker = futures[future]
+            try:
+                e = future.result()
+                envs.append(e)
+                workers[e] = worker
+            except Exception as exc:
+                self.logger.error("create env exception {}".format(exc))
+                worker.stop()
+            complete += 1
+            self.logger.debug("completed {}".format(complete))
         self.envs = envs
+        self.workers = workers
 
     def close(self):
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = []
-            if self.envs:
-                for e in self.envs:
-                    f = executor.submit(e.close)
-                    futures.append(f)
-                for future in concurrent.futures.as_completed(futures):
-                    pass
+        if self.envs:
+            futures = {self.workers[e].submit(e.close):e for e in self.envs}
+            concurrent.futures.wait(futures, self.thread_timeout)
+        for worker in self.workers.values():
+            worker.stop()
+        for worker in self.workers.values():
+            worker.join(self.thread_timeout)
+        self.workers = {}
+
+    def get_latency_percentiles(self, percentiles=(50, 90, 99)):
+        """
+        {percentile: seconds} of send to response latency over every
+        environment's recorded commands.
+        """
+        times = [t for e in self.envs for _, t in e.nhi.latencies]
+        if not times:
+            return {}
+        return dict(zip(percentiles, np.percentile(times, percentiles)))
+
+    def enable_metrics(self, buckets=None):
+        """
+        Start collecting metrics.Metrics on every environment, set
+        NhInterface.COLLECT_METRICS before create_envs to time from connect.
+        """
+        for e in self.envs:
+            e.nhi.enable_metrics(buckets)
+
+    def disable_metrics(self):
+        for e in self.envs:
+            e.nhi.disable_metrics()
+
+    def get_metrics_snapshot(self):
+        """
+        {'environments': {username: snapshot}, 'total': merged snapshot} of
+        the environments collecting metrics. Take it between steps.
+        """
+        snapshots = {e.nhi.username: e.nhi.metrics.snapshot()
+                     for e in self.envs if e.nhi.metrics is not None}
+        return {'environments': snapshots,
+                'total': merge_snapshots(snapshots.values())}
+
+    def export_metrics(self, prefix='nethack'):
+        """
+        Prometheus text format, counters per environment and the stage
+        histograms merged over all of them.
+        """
+        return to_prometheus(self.get_metrics_snapshot()['environments'], prefix)
 
     def get_env_turns(self):
         out_dict = {}
@@ -99,6 +213,17 @@ class MultiThreadEnvironments():
             out_dict[e.nhi.username] = e.nhi.get_status()['t']
         return out_dict
 
+    def get_env_statuses(self):
+        """
+        Status records of every environment stacked into one structured
+        array, e.g. get_env_statuses()['t'] for all the turn counters.
+        """
+        return np.array([e.nhi.get_status() for e in self.envs],
+                        dtype=NhData.STATUS_DTYPE)
+
+    def get_env_turns_array(self):
+        return self.get_env_statuses()['t']
+
 #%%
 if __name__ == '__main__':
 
@@ -179,6 +304,33 @@ if __name__ == '__main__':
 
         return results
 
+#%%
+    def time_dispatch(num, steps=1000):
+        """
+        Per step dispatch overhead without a server, a ThreadPoolExecutor per
+        call against the persistent EnvWorkers.
+        """
+        no_op = lambda: None
+        for i in num:
+            start = time.monotonic()
+            for _ in range(steps):
+                with concurrent.futures.ThreadPoolExecutor() as executor:
+                    futures = [executor.submit(no_op) for _ in range(i)]
+                    concurrent.futures.wait(futures)
+            executor_step = (time.monotonic() - start) / steps
+
+            workers = [EnvWorker('worker{:03}'.format(w)) for w in range(i)]
+            start = time.monotonic()
+            for _ in range(steps):
+                futures = [w.submit(no_op) for w in workers]
+                concurrent.futures.wait(futures)
+            worker_step = (time.monotonic() - start) / steps
+            for w in workers:
+                w.stop()
+            print("{}\texecutor {:.6f}s\tworkers {:.6f}s".format(i, executor_step, worker_step))
+
+    time_dispatch([1, 2, 4, 8, 16, 32, 64])
+
     #time_steps()
     data = time_steps([1,2,4, 8, 16, 32, 64])
     for d in data: